@@ -1,29 +1,56 @@
+from typing import Dict, Optional
+
 from fastapi import FastAPI
 from app.config import logger, settings
 
-from app.api.routes import router
+from app.api.routes import ops_router, router
 from app.config import settings
 from app.integration.chatgpt import OpenAIClient
 from app.integration.http_clients import close_http_clients
+from app.integration.openrouteservice import close_route_cache
+from app.integration.yandex_geocoder import close_geocoder_caches
 from app.services.chat import ChatService
-from app.services.conversation_store import ConversationStore
+from app.services.conversation_store import create_conversation_store
+from app.services.gazetteer import init_gazetteer
+from app.utils.fastjson import FastJSONResponse
+from app.utils.metrics import stats_collector
 from app.utils.prompt_loader import PromptLoader
+from app.utils.tokens import warm_up as warm_up_tokenizer
+
+# Сервис последнего запущенного приложения: метрики chat_* регистрируются один раз на процесс,
+# а не на каждый create_app(), и не держат ссылки на старые экземпляры приложения
+_chat_service: Optional[ChatService] = None
+
+
+def _chat_stats() -> Dict[str, int]:
+    svc = _chat_service
+    return dict(svc.stats) if svc is not None else {}
+
+
+if settings.metrics_enabled:
+    stats_collector("chat", "Chat service", _chat_stats, gauges=())
 
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="GPT-5 Chat Service", version="1.0.0")
+    app = FastAPI(title="GPT-5 Chat Service", version="1.0.0", default_response_class=FastJSONResponse)
 
     @app.on_event("startup")
     def _startup():
+        global _chat_service
         logger.info("Starting up application")
-        client = OpenAIClient(api_key=settings.openai_api_key, model_name=settings.model_name)
+        init_gazetteer()
+        # словарь tiktoken может скачиваться без таймаута — не на пути запроса
+        warm_up_tokenizer(settings.model_name)
+        client = OpenAIClient(
+            api_key=settings.openai_api_key, model_name=settings.model_name, base_url=settings.openai_base_url
+        )
         prompt_loader = PromptLoader(settings.system_prompt_path)
-        store = ConversationStore(settings.conversations_dir)
+        store = create_conversation_store(settings)
         logger.debug(
-            "ChatService init with model=%s, system_prompt_path=%s, conversations_dir=%s, max_history=%s",
+            "ChatService init with model={}, system_prompt_path={}, conversation_backend={}, max_history={}",
             settings.model_name,
             settings.system_prompt_path,
-            settings.conversations_dir,
+            settings.conversation_backend,
             settings.max_history_messages,
         )
         chat_service = ChatService(
@@ -31,12 +58,31 @@ def create_app() -> FastAPI:
             prompt_loader=prompt_loader,
             store=store,
             max_history_messages=settings.max_history_messages,
+            max_history_tokens=settings.max_history_tokens,
+            chain_responses=settings.chat_chain_responses,
         )
         app.state.chat_service = chat_service
+        _chat_service = chat_service
         logger.info("ChatService initialized")
 
+    @app.on_event("shutdown")
+    async def _shutdown():
+        global _chat_service
+        chat_service = getattr(app.state, "chat_service", None)
+        if chat_service is _chat_service:
+            _chat_service = None
+        if chat_service is not None:
+            await chat_service.client.aclose()
+            chat_service.store.close()
+
     app.include_router(router, prefix="/api")
+    if settings.metrics_enabled:
+        app.include_router(ops_router)
     app.add_event_handler("shutdown", close_http_clients)
+    app.add_event_handler("shutdown", close_geocoder_caches)
+    app.add_event_handler("shutdown", close_route_cache)
+    # последним: в режиме prod записи пишутся фоновым потоком — дождаться очереди
+    app.add_event_handler("shutdown", logger.complete)
     logger.info("Router mounted at /api and shutdown handler registered")
     return app
 
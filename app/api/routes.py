@@ -1,19 +1,29 @@
-from app.config import logger
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+from app.config import logger, settings
 
-from app.api.schemas import ChatRequest, ChatResponse, HealthResponse, OptionsIn, RouteRequest, RouteResponse
-from app.integration.openrouteservice import ors_route
-from app.services.chat import ChatService
-from app.services.route_processing import (
-    annotate_intermediate_localities,
-    enrich_localities_with_yandex,
-    ensure_coords,
-    ors_extract_steps,
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+
+from app.api.schemas import (
+    ChatRequest,
+    ChatResponse,
+    HealthResponse,
+    RouteBatchRequest,
+    RouteRequest,
+    RouteResponse,
 )
-from app.services.route_text import build_markdown
+from app.services.chat import ChatService
+from app.services.route_batch import run_batch
+from app.services.route_pipeline import build_route, build_route_rendered
+from app.utils.fastjson import dumps
+from app.utils.metrics import registry
+from app.utils.tracing import start_trace
 
 router = APIRouter()
+# Служебные ручки вне /api (адрес /metrics ожидает Prometheus)
+ops_router = APIRouter()
 
 
 def get_chat_service(request: Request) -> ChatService:
@@ -29,12 +39,17 @@ def healthcheck():
     return HealthResponse()
 
 
+@ops_router.get("/metrics", include_in_schema=False)
+def metrics() -> PlainTextResponse:
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @router.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest, svc: ChatService = Depends(get_chat_service)):
-    logger.info("/chat called: conversation_id=%s", req.conversation_id)
+async def chat(req: ChatRequest, svc: ChatService = Depends(get_chat_service)):
+    logger.info("/chat called: conversation_id={}", req.conversation_id)
     conv_id = str(req.conversation_id) if req.conversation_id else None
-    result = svc.chat(user_text=req.user_text, conversation_id=conv_id)
-    logger.debug("/chat result: conversation_id=%s response_id=%s", result.conversation_id, result.response_id)
+    result = await svc.achat(user_text=req.user_text, conversation_id=conv_id)
+    logger.debug("/chat result: conversation_id={} response_id={}", result.conversation_id, result.response_id)
     return ChatResponse(
         conversation_id=result.conversation_id,
         assistant_text=result.assistant_text,
@@ -42,34 +57,135 @@ def chat(req: ChatRequest, svc: ChatService = Depends(get_chat_service)):
     )
 
 
-@router.post("/route", response_model=RouteResponse)
-async def route(req: RouteRequest) -> RouteResponse:
-    try:
-        logger.info("/route called: a=%s b=%s options=%s", req.a, req.b, req.options)
-        a_lat, a_lon, a_label = await ensure_coords(req.a)
-        b_lat, b_lon, b_label = await ensure_coords(req.b)
-        logger.debug("Resolved coords: A=(%s,%s) B=(%s,%s)", a_lat, a_lon, b_lat, b_lon)
+def _sse(event: Dict[str, Any]) -> bytes:
+    return b"event: " + event["type"].encode("utf-8") + b"\ndata: " + dumps(event) + b"\n\n"
+
+
+@router.post("/chat/stream")
+async def chat_stream(req: ChatRequest, svc: ChatService = Depends(get_chat_service)) -> StreamingResponse:
+    """Ответ модели по мере генерации (SSE): ``start`` → ``delta``… → ``done`` | ``error``."""
+    logger.info("/chat/stream called: conversation_id={}", req.conversation_id)
+    conv_id = str(req.conversation_id) if req.conversation_id else None
 
-        opts = req.options or OptionsIn(language="ru", avoid_tolls=False)
-        data = await ors_route(a_lat, a_lon, b_lat, b_lon, opts)
-        steps, total_m, total_s, coords, step_bounds = ors_extract_steps(data)
-        logger.debug("ORS returned: steps=%d total_m=%s total_s=%s", len(steps), total_m, total_s)
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            async for event in svc.achat_stream(user_text=req.user_text, conversation_id=conv_id):
+                yield _sse(event)
+        except Exception as e:
+            logger.exception("chat stream failed")
+            yield _sse({"type": "error", "message": str(e)})
 
-        if not steps:
-            logger.info("/route: empty steps")
-            return RouteResponse(ok=False, type="error", message="Маршрут пуст (нет шагов)")
+    return StreamingResponse(body(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
-        # Обогащаем locality и добавляем промежуточные населённые пункты на длинных шагах
-        await enrich_localities_with_yandex(steps)
-        await annotate_intermediate_localities(steps, step_bounds, coords, min_step_m=5000, sample_interval_m=5000)
 
-        md = build_markdown(a_label, a_lat, a_lon, b_label, b_lat, b_lon, steps, total_m, total_s)
-        logger.info("/route success: steps=%d", len(steps))
-        return RouteResponse(ok=True, markdown=md, steps=steps)
+def _model_response(res: RouteResponse) -> Response:
+    # Ответ собран из уже проверенных данных: сериализуем напрямую, без повторной
+    # валидации через response_model (она остаётся для схемы OpenAPI)
+    return Response(res.model_dump_json(), media_type="application/json")
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+_DEBUG_QUERY = Query(False, description="Вернуть разбивку времени по фазам в поле timing")
+
+
+@router.post("/route", response_model=RouteResponse)
+async def route(req: RouteRequest, request: Request, debug: bool = _DEBUG_QUERY) -> Response:
+    """Маршрут A → B. Успешный ответ несёт ETag — хеш маршрута и результатов обогащения;
+    запрос с совпадающим ``If-None-Match`` получает 304 без тела.
+    Время по фазам отдаётся в заголовке ``Server-Timing``."""
+    with start_trace("route") as trace:
+        resp = await _route(req, request, debug)
+        resp.headers["Server-Timing"] = trace.server_timing()
+    return resp
+
+
+async def _route(req: RouteRequest, request: Request, debug: bool) -> Response:
+    try:
+        logger.info("/route called: a={} b={} options={}", req.a, req.b, req.options)
+        res = await build_route_rendered(req, debug=debug)
+        if res.etag is None:
+            return Response(res.body, media_type="application/json")
+        if _etag_matches(request.headers.get("if-none-match"), res.etag):
+            return Response(status_code=304, headers={"ETag": res.etag})
+        return Response(res.body, media_type="application/json", headers={"ETag": res.etag})
 
     except HTTPException as he:
-        logger.info("/route HTTPException: %s", he.detail)
-        return RouteResponse(ok=False, type="error", message=str(he.detail))
+        logger.info("/route HTTPException: {}", he.detail)
+        return _model_response(RouteResponse(ok=False, type="error", message=str(he.detail)))
     except Exception as e:
         logger.exception("unexpected error")
-        return RouteResponse(ok=False, type="error", message=f"Неожиданная ошибка: {e}")
+        return _model_response(RouteResponse(ok=False, type="error", message=f"Неожиданная ошибка: {e}"))
+
+
+def _ndjson(event: Dict[str, Any]) -> bytes:
+    return dumps(event) + b"\n"
+
+
+@router.post("/route/stream")
+async def route_stream(req: RouteRequest, debug: bool = _DEBUG_QUERY) -> StreamingResponse:
+    """Потоковый /route (NDJSON): ``summary`` → ``step``… → ``markdown`` → ``done``.
+
+    Ошибка в середине потока приходит событием ``error`` (HTTP-статус к этому моменту уже 200).
+    С ``debug`` событие ``done`` несёт разбивку времени по фазам в ``timing``.
+    """
+    logger.info("/route/stream called: a={} b={} options={}", req.a, req.b, req.options)
+    queue: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+
+    async def run() -> None:
+        try:
+            with start_trace("route_stream") as trace:
+                res = await build_route(req, on_event=queue.put)
+            if res.ok:
+                done: Dict[str, Any] = {"type": "done", "ok": True}
+                if debug:
+                    done["timing"] = trace.breakdown()
+                await queue.put(done)
+            else:
+                await queue.put({"type": "error", "message": res.message})
+        except HTTPException as he:
+            logger.info("/route/stream HTTPException: {}", he.detail)
+            await queue.put({"type": "error", "message": str(he.detail)})
+        except Exception as e:
+            logger.exception("unexpected error")
+            await queue.put({"type": "error", "message": f"Неожиданная ошибка: {e}"})
+        finally:
+            await queue.put(None)
+
+    async def body() -> AsyncIterator[bytes]:
+        task = asyncio.create_task(run())
+        try:
+            while (event := await queue.get()) is not None:
+                yield _ndjson(event)
+        finally:
+            # клиент отключился — незачем тратить квоту геокодера
+            task.cancel()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+@router.post("/route/batch")
+async def route_batch(req: RouteBatchRequest) -> StreamingResponse:
+    """Пакет маршрутов (NDJSON): ``item`` на каждый маршрут по мере готовности → ``done``.
+
+    ``item`` содержит ``index`` в ``items`` и ``result`` в формате ответа /route;
+    ошибка отдельного маршрута приходит как ``result.ok == false``.
+    """
+    if len(req.items) > settings.route_batch_max_items:
+        raise HTTPException(413, f"Слишком большой пакет: {len(req.items)} > {settings.route_batch_max_items}")
+    logger.info("/route/batch called: items={} concurrency={}", len(req.items), req.concurrency)
+
+    async def body() -> AsyncIterator[bytes]:
+        ok = 0
+        # закрытие генератора при отключении клиента отменяет оставшуюся работу пакета
+        async for item in run_batch(req.items, req.concurrency):
+            ok += item.result.ok
+            yield _ndjson({"type": "item", **item.model_dump()})
+        yield _ndjson({"type": "done", "count": len(req.items), "ok": ok})
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
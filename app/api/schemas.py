@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel, Field, model_validator
 
@@ -36,6 +36,10 @@ class OptionsIn(BaseModel):
     # В ORS нет трафика, но оставим поле для совместимости интерфейса
     avoid_tolls: bool = False
     language: str = Field("ru", description="Язык инструкций ORS (e.g. 'ru')")
+    include_geometry: bool = Field(False, description="Вернуть линию маршрута в RouteResponse.geometry")
+    geometry_tolerance_m: Optional[float] = Field(
+        None, ge=0, description="Допуск упрощения линии (м); по умолчанию — из настроек, 0 — без упрощения"
+    )
 
 
 class ViaLocality(BaseModel):
@@ -44,14 +48,22 @@ class ViaLocality(BaseModel):
     lon: float
 
 
+# ORS принимает до 50 точек маршрута, включая A и B
+MAX_WAYPOINTS = 48
+
+
 class RouteRequest(BaseModel):
     a: PointIn
     b: PointIn
+    waypoints: Optional[List[PointIn]] = Field(
+        None, max_length=MAX_WAYPOINTS, description="Промежуточные остановки между A и B, по порядку"
+    )
     options: Optional[OptionsIn] = None
 
 
 class StepOut(BaseModel):
     idx: int
+    leg: int = Field(0, description="Номер участка между соседними остановками (с 0)")
     start_lat: float
     start_lon: float
     distance_m: int
@@ -66,5 +78,17 @@ class RouteResponse(BaseModel):
     ok: bool
     markdown: Optional[str] = None
     steps: Optional[List[StepOut]] = None
+    geometry: Optional[str] = Field(None, description="Линия маршрута: encoded polyline, точность 1e-5")
     type: Optional[str] = "result"
     message: Optional[str] = None
+    timing: Optional[Dict[str, float]] = Field(None, description="Время по фазам, мс (только при ?debug=true)")
+
+
+class RouteBatchRequest(BaseModel):
+    items: List[RouteRequest] = Field(..., min_length=1)
+    concurrency: Optional[int] = Field(None, ge=1, description="Сколько маршрутов строить одновременно")
+
+
+class RouteBatchItem(BaseModel):
+    index: int = Field(..., description="Позиция запроса в items")
+    result: RouteResponse
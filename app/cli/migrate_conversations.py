@@ -0,0 +1,62 @@
+"""Перенос истории диалогов из каталога JSONL в SQLite.
+
+Запуск::
+
+    python -m app.cli.migrate_conversations --src conversations --db conversations.sqlite3
+
+Повторный запуск безопасен: диалоги, уже присутствующие в базе, пропускаются
+(``--force`` перезаписывает их заново).
+"""
+
+import argparse
+from pathlib import Path
+
+from app.config import logger, settings
+from app.services.conversation_sqlite import connect
+from app.utils.fastjson import JSONDecodeError, dumps_str, loads
+
+
+def migrate(src: Path, db: Path, force: bool = False) -> int:
+    conn = connect(db, synchronous="off")
+    migrated = skipped = records = 0
+    try:
+        for p in sorted(src.glob("*.jsonl")):
+            conv_id = p.stem
+            exists = conn.execute("SELECT 1 FROM messages WHERE conversation_id = ? LIMIT 1", (conv_id,)).fetchone()
+            if exists and not force:
+                skipped += 1
+                continue
+            rows = []
+            with p.open(encoding="utf-8") as f:
+                for n, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        rec = loads(line)
+                    except JSONDecodeError as e:
+                        logger.warning("{}:{}: skipping malformed line: {}", p, n, e)
+                        continue
+                    rows.append((conv_id, rec.get("ts"), dumps_str(rec)))
+            with conn:
+                if exists:
+                    conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conv_id,))
+                conn.executemany("INSERT INTO messages (conversation_id, ts, record) VALUES (?, ?, ?)", rows)
+            migrated += 1
+            records += len(rows)
+    finally:
+        conn.close()
+    logger.info("Migrated conversations={} records={} skipped={}", migrated, records, skipped)
+    return migrated
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--src", type=Path, default=settings.conversations_dir, help="каталог с <id>.jsonl")
+    ap.add_argument("--db", type=Path, default=settings.conversations_db_path, help="путь к SQLite-базе")
+    ap.add_argument("--force", action="store_true", help="перезаписать уже перенесённые диалоги")
+    args = ap.parse_args()
+    migrate(args.src, args.db, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
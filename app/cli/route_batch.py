@@ -0,0 +1,69 @@
+"""Пакетное построение маршрутов без HTTP-сервера.
+
+Запуск::
+
+    python -m app.cli.route_batch requests.jsonl --out results.jsonl --concurrency 8
+
+Вход — JSONL (по ``RouteRequest`` на строку) или JSON-массив; ``-`` читает stdin.
+Выход — JSONL с ``{"index": ..., "result": {...}}`` в порядке готовности.
+"""
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+from typing import List, TextIO
+
+from app.api.schemas import RouteRequest
+from app.config import logger
+from app.integration.http_clients import close_http_clients
+from app.integration.openrouteservice import close_route_cache
+from app.integration.yandex_geocoder import close_geocoder_caches
+from app.services.gazetteer import init_gazetteer
+from app.services.route_batch import run_batch
+from app.utils.fastjson import loads
+
+
+def load_requests(text: str) -> List[RouteRequest]:
+    text = text.strip()
+    if text.startswith("["):
+        return [RouteRequest.model_validate(x) for x in loads(text)]
+    return [RouteRequest.model_validate_json(line) for line in text.splitlines() if line.strip()]
+
+
+async def build_batch(requests: List[RouteRequest], out: TextIO, concurrency: int | None = None) -> int:
+    """Строит пакет и пишет результаты в ``out``; возвращает число неудачных маршрутов."""
+    failed = 0
+    try:
+        async for item in run_batch(requests, concurrency):
+            failed += not item.result.ok
+            out.write(item.model_dump_json() + "\n")
+            out.flush()
+    finally:
+        await close_http_clients()
+        close_geocoder_caches()
+        close_route_cache()
+    return failed
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("src", help="файл с запросами (JSONL или JSON-массив), '-' — stdin")
+    ap.add_argument("--out", type=Path, default=None, help="куда писать результаты (по умолчанию stdout)")
+    ap.add_argument("--concurrency", type=int, default=None, help="маршрутов одновременно")
+    args = ap.parse_args()
+
+    text = sys.stdin.read() if args.src == "-" else Path(args.src).read_text(encoding="utf-8")
+    requests = load_requests(text)
+    init_gazetteer()
+    logger.info("Loaded {} route requests from {}", len(requests), args.src)
+    if args.out is None:
+        failed = asyncio.run(build_batch(requests, sys.stdout, args.concurrency))
+    else:
+        with args.out.open("w", encoding="utf-8") as f:
+            failed = asyncio.run(build_batch(requests, f, args.concurrency))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 import sys
+from collections import defaultdict
 from functools import lru_cache
 from pathlib import Path
+from typing import Dict, Optional, Tuple
 
 from loguru import logger as log
+from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -13,6 +16,10 @@ class Settings(BaseSettings):
     host: str = "127.0.0.1"
     port: int = 8000
     reload: bool = False
+    metrics_enabled: bool = True  # Prometheus text format at /metrics
+    trace_sample_rate: float = 0.01  # share of /route requests whose phase breakdown is logged
+    trace_slow_ms: float = 5000  # always log traces slower than this; 0 disables
+    fast_json: bool = True  # orjson for upstream parsing, API responses and stores when installed
 
     # Model and paths
     model_name: str = "gpt-5-mini"
@@ -21,20 +28,97 @@ class Settings(BaseSettings):
 
     # Other settings
     max_history_messages: int | None = None
+    max_history_tokens: int | None = None  # token budget for replayed history (local tokenizer)
+    chat_chain_responses: bool = False  # send only the new turn with previous_response_id
+    conversation_cache_size: int = 1024  # recently active conversations kept in memory
+    conversation_cache_window: int = 200  # records kept per cached conversation
+
+    # Conversation storage backend: "jsonl" (one file per conversation) or "sqlite" (WAL, batched writes)
+    conversation_backend: str = "jsonl"
+    conversations_db_path: Path = Path("conversations.sqlite3")
+    conversation_sqlite_synchronous: str = "normal"  # off | normal | full
+    conversation_flush_interval_s: float = 0.05
+    conversation_batch_size: int = 256
 
     # Environment variables
     openai_api_key: str = ""
     yandex_geocoder_api_key: str = ""
     ors_api_key: str = ""
 
-    # Logging
+    # Logging. "dev": text file sink at DEBUG, written inline.
+    # "prod": JSON file sink at log_lvl, both sinks written from a background thread
     log_lvl: str = "INFO"
     log_path: Path = Path("logs/app.log")
+    log_mode: str = "dev"
+    log_debug_sample_every: int = 1  # keep one of N DEBUG records per call site (1 = all)
 
     # External services
     yandex_geocoder_url: str = "https://geocode-maps.yandex.ru/v1"
     ors_directions_url: str = "https://api.openrouteservice.org/v2/directions/driving-car/geojson"
-    rev_geocoder_concurrency: int = 4
+    openai_base_url: str | None = None  # e.g. a local stand-in for load tests; None = SDK default
+    rev_geocoder_concurrency: int = 4  # initial concurrency; adjusted at runtime by the geocoder scheduler
+
+    # Geocoder scheduler: token-bucket rate limit + AIMD concurrency + retries
+    # Rate limit is off by default (<= 0 = unlimited): Yandex quotas are per day, not per second,
+    # and the AIMD limit plus 429 backoff already adapt to throttling. Set it for a contract with an RPS cap.
+    geocoder_rate_limit_rps: float = 0.0
+    geocoder_burst: int = 20  # bucket size when the rate limit is enabled
+    geocoder_min_concurrency: int = 1
+    geocoder_max_concurrency: int = 32
+    geocoder_target_latency_s: float = 1.0
+    geocoder_max_retries: int = 3
+    geocoder_backoff_base_s: float = 0.2
+    geocoder_backoff_max_s: float = 5.0
+
+    # Geocoder cache (None or an empty value disables the on-disk tier)
+    geocode_cache_path: Path | None = Path("cache/geocode.sqlite3")
+    rev_geocode_cache_grid_deg: float = 0.001
+    rev_geocode_cache_ttl_s: float = 30 * 24 * 3600
+    rev_geocode_cache_memory_entries: int = 20000
+    rev_geocode_cache_disk_entries: int = 1_000_000
+    fwd_geocode_cache_ttl_s: float = 30 * 24 * 3600
+    fwd_geocode_cache_negative_ttl_s: float = 24 * 3600
+    fwd_geocode_cache_memory_entries: int = 5000
+    fwd_geocode_cache_disk_entries: int = 200_000
+
+    # ORS route cache (endpoints snapped to the tolerance, sizes in bytes of compressed payload)
+    ors_route_cache_snap_deg: float = 0.0005
+    ors_route_cache_ttl_s: float = 7 * 24 * 3600
+    ors_route_cache_memory_bytes: int = 64 * 1024 * 1024
+    ors_route_cache_disk_bytes: int = 1024 * 1024 * 1024
+    ors_max_concurrency: int = 4  # process-wide limit on in-flight ORS requests
+    route_geometry_tolerance_m: float = 10.0  # Douglas-Peucker tolerance for RouteResponse.geometry
+    # Rendered /route output (markdown + JSON body) keyed by the content hash that is also the ETag
+    route_render_cache_bytes: int = 32 * 1024 * 1024
+    route_render_cache_ttl_s: float = 3600
+
+    # /route/batch: routes built concurrently per batch and the batch size limit
+    route_batch_concurrency: int = 8
+    route_batch_max_items: int = 1000
+
+    # Locality envelope index (shrink: fraction of the boundedBy envelope trusted around its centre)
+    locality_index_enabled: bool = True
+    locality_index_shrink: float = 0.7
+    locality_index_max_entries: int = 20000
+
+    # Offline gazetteer (CSV name,lat,lon[,population] or GeoJSON) consulted before reverse geocoding;
+    # match radius = k * sqrt(population), clamped to [gazetteer_radius_m, gazetteer_max_radius_m]
+    gazetteer_path: Path | None = None
+    gazetteer_radius_m: float = 2000
+    gazetteer_radius_per_sqrt_pop_m: float = 6.0
+    gazetteer_max_radius_m: float = 25000
+
+    # Via-locality sampling: "fixed" (every N metres) or "adaptive" (coarse pass + bisection on name changes)
+    via_sampling_mode: str = "fixed"
+    via_adaptive_coarse_interval_m: float = 20000
+    via_adaptive_min_spacing_m: float = 2500
+    via_adaptive_call_budget: int = 200
+
+    @field_validator("geocode_cache_path", mode="before")
+    @classmethod
+    def _empty_path_is_none(cls, v):
+        # GEOCODE_CACHE_PATH= иначе превращается в Path("."), а не в «диск выключен»
+        return None if isinstance(v, str) and not v.strip() else v
 
     # pydantic-settings configuration
     model_config = SettingsConfigDict(
@@ -43,10 +127,53 @@ class Settings(BaseSettings):
     )
 
 
+class DebugSampler:
+    """Фильтр sink'а: пропускает каждую ``every``-ю DEBUG-запись с одного места вызова.
+
+    Частые отладочные сообщения (по шагу, по точке) не забивают лог, а редкие
+    места вызова всё равно видны. Записи уровня INFO и выше проходят всегда.
+    """
+
+    def __init__(self, every: int):
+        self.every = max(1, every)
+        self._seen: Dict[Tuple[str, int], int] = defaultdict(int)
+
+    def __call__(self, record) -> bool:
+        if record["level"].no > 10:  # выше DEBUG
+            return True
+        site = (record["name"], record["line"])
+        n = self._seen[site]
+        self._seen[site] = n + 1
+        return n % self.every == 0
+
+
 @lru_cache()
-def get_logger(log_path: Path, level: str):
+def get_logger(log_path: Path, level: str, mode: str = "dev", debug_sample_every: int = 1):
+    """Настраивает sink'и loguru.
+
+    ``dev``: текст в stderr (``level``) и в файл (DEBUG), запись синхронно.
+    ``prod``: JSON в файл на уровне ``level``, оба sink'а пишутся фоновым потоком
+    (``enqueue``), так что event loop не ждёт диск. Отладочные вызовы при этом
+    отсекаются по уровню ещё до форматирования сообщения.
+    """
+    if mode not in ("dev", "prod"):
+        raise ValueError(f"Unknown log_mode: {mode!r}")
+    prod = mode == "prod"
+
+    def sampler() -> Optional[DebugSampler]:
+        # у каждого sink'а свои счётчики: фильтр вызывается на каждый sink
+        return DebugSampler(debug_sample_every) if debug_sample_every > 1 else None
+
     log.remove(0)
-    log.add(sys.stderr, format="{time} | {level} | {message}", level=level)
+    log.add(
+        sys.stderr,
+        format="{time} | {level} | {message}",
+        level=level,
+        filter=sampler(),
+        enqueue=prod,
+        backtrace=not prod,
+        diagnose=not prod,
+    )
     # Ensure log directory exists
     try:
         log_path.parent.mkdir(parents=True, exist_ok=True)
@@ -55,7 +182,12 @@ def get_logger(log_path: Path, level: str):
     log.add(
         log_path,
         format="{time} | {level} | {message}",
-        level="DEBUG",
+        level=level if prod else "DEBUG",
+        filter=sampler(),
+        serialize=prod,
+        enqueue=prod,
+        backtrace=not prod,
+        diagnose=not prod,
         rotation="1 days",
         retention="30 days",
         catch=True,
@@ -69,5 +201,5 @@ def get_settings() -> Settings:
 
 
 settings = get_settings()
-logger = get_logger(settings.log_path, settings.log_lvl)
+logger = get_logger(settings.log_path, settings.log_lvl, settings.log_mode, settings.log_debug_sample_every)
 
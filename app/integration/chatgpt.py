@@ -7,11 +7,12 @@ without dealing with low level configuration details.
 
 from __future__ import annotations
 
-from typing import Any
+from typing import Any, AsyncIterator, Dict, Optional
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
 from app.config import settings
+from app.utils.metrics import upstream_errors, upstream_seconds
 
 
 class OpenAIClient:
@@ -21,13 +22,25 @@ class OpenAIClient:
         self,
         api_key: str = settings.openai_api_key,
         model_name: str = settings.model_name,
+        base_url: Optional[str] = settings.openai_base_url,
     ) -> None:
         self.model_name = model_name
         # ``OpenAI`` reads the key from the environment if ``api_key`` is ``None``.
-        # Passing it explicitly keeps the behaviour predictable.
-        self._client = OpenAI(api_key=api_key)
+        # Passing it explicitly keeps the behaviour predictable. ``base_url`` of
+        # ``None`` keeps the SDK default (or ``OPENAI_BASE_URL``).
+        self._client = OpenAI(api_key=api_key, base_url=base_url)
+        self._aclient = AsyncOpenAI(api_key=api_key, base_url=base_url)
 
-    def create(self, input_data: Any):
+    def _params(self, input_data: Any, previous_response_id: Optional[str]) -> Dict[str, Any]:
+        params: Dict[str, Any] = {"model": self.model_name, "input": input_data}
+        if previous_response_id:
+            # The chained context lives server-side; let the API drop the oldest
+            # turns instead of failing once it outgrows the context window.
+            params["previous_response_id"] = previous_response_id
+            params["truncation"] = "auto"
+        return params
+
+    def create(self, input_data: Any, previous_response_id: Optional[str] = None):
         """Send ``input_data`` to the Responses API.
 
         Parameters
@@ -35,11 +48,49 @@ class OpenAIClient:
         input_data:
             Either a plain string prompt or a list of messages compatible with
             the Responses API.
+        previous_response_id:
+            Continue the server-side conversation ending with this response;
+            ``input_data`` then only needs the new messages.
+        """
+
+        try:
+            with upstream_seconds.time("openai"):
+                return self._client.responses.create(**self._params(input_data, previous_response_id))
+        except Exception:
+            upstream_errors.inc("openai")
+            raise
+
+    async def acreate(self, input_data: Any, previous_response_id: Optional[str] = None):
+        """Async counterpart of :meth:`create` that does not block a worker thread."""
+
+        try:
+            with upstream_seconds.time("openai"):
+                return await self._aclient.responses.create(**self._params(input_data, previous_response_id))
+        except Exception:
+            upstream_errors.inc("openai")
+            raise
+
+    async def astream(self, input_data: Any, previous_response_id: Optional[str] = None) -> AsyncIterator[Any]:
+        """Stream Responses API events for ``input_data``.
+
+        Yields the raw SDK events; ``response.output_text.delta`` carries text
+        chunks and ``response.completed`` carries the final response object.
+        The ``openai_stream`` latency metric covers the whole stream.
         """
 
-        return self._client.responses.create(
-            model=self.model_name,
-            input=input_data,
-        )
+        try:
+            with upstream_seconds.time("openai_stream"):
+                stream = await self._aclient.responses.create(
+                    **self._params(input_data, previous_response_id),
+                    stream=True,
+                )
+                async for event in stream:
+                    yield event
+        except Exception:
+            upstream_errors.inc("openai_stream")
+            raise
+
+    async def aclose(self) -> None:
+        await self._aclient.close()
 
     # Removed deprecated run_prompt_file utility to simplify integration surface.
@@ -0,0 +1,208 @@
+"""Планировщик запросов к геокодеру.
+
+Заменяет фиксированный семафор: token bucket ограничивает частоту запросов, а лимит
+параллельности подстраивается по AIMD — растёт на быстрых успешных ответах и
+сжимается на 429/5xx и медленных ответах. Ожидающие слота запросы обслуживаются
+по приоритету (прямое геокодирование и начала шагов раньше промежуточных точек),
+временные ошибки повторяются с экспоненциальной задержкой и jitter.
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.config import logger
+from app.utils.metrics import Histogram
+
+PRIORITY_FORWARD = 0
+PRIORITY_STEP = 1
+PRIORITY_VIA = 2
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_PRIORITY_NAMES = {PRIORITY_FORWARD: "forward", PRIORITY_STEP: "step", PRIORITY_VIA: "via"}
+
+wait_seconds = Histogram(
+    "geocoder_wait_seconds", "Time a geocoder call waited for a concurrency slot and a rate-limit token", ["priority"]
+)
+
+
+class TokenBucket:
+    """Token bucket с резервированием: токены могут уйти в минус, и каждый вызов
+    просто ждёт своей очереди, так что блокировка не нужна."""
+
+    def __init__(self, rate_per_s: float, burst: int):
+        self.rate = rate_per_s
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+
+    async def acquire(self) -> float:
+        """Забирает токен, при необходимости дожидаясь пополнения. Возвращает время ожидания."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        delay = -self._tokens / self.rate
+        await asyncio.sleep(delay)
+        return delay
+
+
+class GeocoderScheduler:
+    def __init__(
+        self,
+        *,
+        rate_per_s: float,
+        burst: int,
+        initial_concurrency: int,
+        min_concurrency: int = 1,
+        max_concurrency: int = 32,
+        target_latency_s: float = 1.0,
+        decrease_factor: float = 0.5,
+        max_retries: int = 3,
+        backoff_base_s: float = 0.2,
+        backoff_max_s: float = 5.0,
+    ):
+        self.bucket = TokenBucket(rate_per_s, burst)
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self._limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self.target_latency_s = target_latency_s
+        self.decrease_factor = decrease_factor
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self._in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._last_decrease = 0.0
+        self.throttled = 0
+        self.retries = 0
+
+    @property
+    def concurrency(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self._in_flight,
+            "waiting": len(self._waiters),
+            "throttled": self.throttled,
+            "retries": self.retries,
+        }
+
+    async def _acquire(self, priority: int) -> None:
+        if self._in_flight < self.concurrency and not self._waiters:
+            self._in_flight += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # слот уже был выдан — вернуть его
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self._in_flight < self.concurrency:
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self._in_flight += 1
+            fut.set_result(None)
+
+    def _on_success(self, latency_s: float) -> None:
+        if latency_s <= self.target_latency_s:
+            # аддитивный рост: примерно +1 слот за «окно» из limit успешных ответов,
+            # и только когда лимит действительно упирается (иначе он растёт «в пустоту»)
+            if self._in_flight >= self.concurrency:
+                self._limit = min(self.max_concurrency, self._limit + 1.0 / self._limit)
+                self._wake()
+        else:
+            self._decrease("slow", latency_s)
+
+    def _decrease(self, reason: str, latency_s: float) -> None:
+        now = time.monotonic()
+        # не сжимаемся чаще раза за целевую задержку: один всплеск ошибок — одно уменьшение
+        if now - self._last_decrease < self.target_latency_s:
+            return
+        self._last_decrease = now
+        old = self._limit
+        self._limit = max(self.min_concurrency, self._limit * self.decrease_factor)
+        logger.info("Geocoder concurrency {:.1f} -> {:.1f} ({}, latency={:.2f}s)", old, self._limit, reason, latency_s)
+
+    def _backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return min(self.backoff_max_s, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * (2**attempt)))
+
+    async def request(
+        self,
+        send: Callable[[], Awaitable[httpx.Response]],
+        priority: int = PRIORITY_STEP,
+        skip: Optional[Callable[[], bool]] = None,
+    ) -> Optional[httpx.Response]:
+        """Выполняет ``send()`` в слоте планировщика с повторами на 429/5xx и сетевых ошибках.
+
+        ``skip()`` проверяется, когда слот уже получен, но до токена и запроса: если он
+        вернул True (ответ стал известен, пока запрос стоял в очереди), возвращается None.
+        """
+        attempt = 0
+        while True:
+            t_wait = time.monotonic()
+            await self._acquire(priority)
+            try:
+                if skip is not None and skip():
+                    return None
+                await self.bucket.acquire()
+                t0 = time.monotonic()
+                wait_seconds.observe(t0 - t_wait, _PRIORITY_NAMES.get(priority, str(priority)))
+                try:
+                    r = await send()
+                except httpx.TransportError as e:
+                    latency = time.monotonic() - t0
+                    self._decrease("transport error", latency)
+                    if attempt >= self.max_retries:
+                        raise
+                    logger.debug("Geocoder transport error (attempt {}): {}", attempt + 1, e)
+                    retry_after = None
+                else:
+                    latency = time.monotonic() - t0
+                    if r.status_code not in RETRY_STATUSES:
+                        self._on_success(latency)
+                        return r
+                    if r.status_code == 429:
+                        self.throttled += 1
+                    self._decrease(f"HTTP {r.status_code}", latency)
+                    if attempt >= self.max_retries:
+                        return r
+                    retry_after = r.headers.get("Retry-After")
+            finally:
+                self._release()
+            delay = self._backoff(attempt, retry_after)
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
@@ -1,11 +1,94 @@
-from typing import Optional
+import asyncio
+import zlib
+from typing import Any, Optional, Sequence, Tuple
 
 from fastapi import HTTPException
 
 from app.api.schemas import OptionsIn
 from app.config import logger, settings
 from app.integration.http_clients import ors_client
+from app.utils.cache import MISSING, SqliteCache, TieredCache, TTLCache
+from app.utils.fastjson import dumps, loads
 from app.utils.http import safe_http_error_message
+from app.utils.metrics import upstream_errors, upstream_seconds
+
+
+def _pack(value: Any) -> bytes:
+    return zlib.compress(dumps(value), 6)
+
+
+def _unpack(raw: bytes) -> Any:
+    return loads(zlib.decompress(raw))
+
+
+route_cache = TieredCache(
+    "ors_route",
+    memory=TTLCache(max_bytes=settings.ors_route_cache_memory_bytes, ttl_s=settings.ors_route_cache_ttl_s),
+    disk=(
+        SqliteCache(settings.geocode_cache_path, "routes", max_bytes=settings.ors_route_cache_disk_bytes)
+        if settings.geocode_cache_path
+        else None
+    ),
+    dumps=_pack,
+    loads=_unpack,
+)
+
+
+# Общий на процесс лимит одновременных запросов к ORS (одиночные /route и пакеты делят его)
+_ors_slots = asyncio.Semaphore(max(1, settings.ors_max_concurrency))
+
+
+def route_cache_key(
+    a_lat: float,
+    a_lon: float,
+    b_lat: float,
+    b_lon: float,
+    opt: OptionsIn,
+    via: Sequence[Tuple[float, float]] = (),
+) -> str:
+    tol = settings.ors_route_cache_snap_deg
+    values = [a_lat, a_lon, *(x for p in via for x in p), b_lat, b_lon]
+    pts = ":".join(f"{round(x / tol) * tol:.6f}" for x in values)
+    return f"{pts}:{opt.language}:{int(opt.avoid_tolls)}"
+
+
+def compact_ors_response(data: dict) -> dict:
+    """Оставляет из GeoJSON ORS только то, что читает ``ors_extract_steps``.
+
+    Структура ответа сохраняется, так что компактная форма взаимозаменяема с полной.
+    """
+    features = data.get("features") or []
+    if not features:
+        return {"features": []}
+    feat = features[0]
+    props = feat.get("properties", {}) or {}
+    summary = props.get("summary", {}) or {}
+    coords = (feat.get("geometry") or {}).get("coordinates") or []
+    segments = []
+    for seg in props.get("segments", []) or []:
+        steps = []
+        for st in seg.get("steps", []) or []:
+            steps.append(
+                {
+                    "distance": st.get("distance", 0),
+                    "duration": st.get("duration", 0),
+                    "instruction": st.get("instruction"),
+                    "name": st.get("name"),
+                    "way_points": st.get("way_points", [0, 0]),
+                }
+            )
+        segments.append({"steps": steps})
+    return {
+        "features": [
+            {
+                "geometry": {"coordinates": [[round(c[0], 6), round(c[1], 6)] for c in coords]},
+                "properties": {
+                    "summary": {"distance": summary.get("distance", 0.0), "duration": summary.get("duration", 0.0)},
+                    "segments": segments,
+                },
+            }
+        ]
+    }
 
 
 async def ors_route(
@@ -14,13 +97,24 @@ async def ors_route(
     b_lat: float,
     b_lon: float,
     opt: Optional[OptionsIn] = None,
+    via: Sequence[Tuple[float, float]] = (),
 ) -> dict:
+    """Маршрут A → (via…) → B одним запросом; ``via`` — промежуточные (lat, lon).
+
+    ORS возвращает по сегменту на каждый участок между соседними точками.
+    """
     if opt is None:
         opt = OptionsIn()
-    logger.debug("Requesting ORS: A=(%s,%s) B=(%s,%s) opts=%s", a_lat, a_lon, b_lat, b_lon, opt)
+    key = route_cache_key(a_lat, a_lon, b_lat, b_lon, opt, via)
+    cached = await route_cache.aget(key)
+    if cached is not MISSING:
+        logger.debug("ORS route cache hit: {}", key)
+        return cached
+
+    logger.debug("Requesting ORS: A=({},{}) via={} B=({},{}) opts={}", a_lat, a_lon, len(via), b_lat, b_lon, opt)
     headers = {"Authorization": settings.ors_api_key, "Content-Type": "application/json"}
     body = {
-        "coordinates": [[a_lon, a_lat], [b_lon, b_lat]],  # ORS: [lon, lat]
+        "coordinates": [[a_lon, a_lat], *([lon, lat] for lat, lon in via), [b_lon, b_lat]],  # ORS: [lon, lat]
         "language": opt.language,
         "units": "m",
         "instructions": True,
@@ -28,8 +122,23 @@ async def ors_route(
     if opt.avoid_tolls:
         body["options"] = {"avoid_features": ["tollways"]}
 
-    r = await ors_client.post(settings.ors_directions_url, headers=headers, json=body)
+    async with _ors_slots:
+        try:
+            with upstream_seconds.time("ors"):
+                r = await ors_client.post(settings.ors_directions_url, headers=headers, json=body)
+        except Exception:
+            upstream_errors.inc("ors")
+            raise
     if r.status_code != 200:
+        upstream_errors.inc("ors")
         raise HTTPException(502, f"ORS HTTP {r.status_code}: {safe_http_error_message(r)}")
-    logger.debug("ORS HTTP %s", r.status_code)
-    return r.json()
+    logger.debug("ORS HTTP {}", r.status_code)
+    data = compact_ors_response(loads(r.content))
+    if data["features"]:
+        route_cache.set(key, data)
+    return data
+
+
+def close_route_cache() -> None:
+    logger.info("Cache {} stats: {}", route_cache.name, route_cache.stats())
+    route_cache.close()
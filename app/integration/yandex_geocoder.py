@@ -1,16 +1,124 @@
-import asyncio
-from typing import Dict, Optional, Tuple
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
+import httpx
 from fastapi import HTTPException
 
 from app.config import settings, logger
+from app.integration.geocoder_scheduler import PRIORITY_FORWARD, PRIORITY_STEP, GeocoderScheduler
 from app.integration.http_clients import geocoder_client
+from app.utils.cache import MISSING, SqliteCache, TieredCache, TTLCache
+from app.utils.fastjson import loads
 from app.utils.http import safe_http_error_message
+from app.utils.metrics import Family, ScopedCounter, registry, upstream_errors, upstream_seconds
 
-_rev_sem = asyncio.Semaphore(settings.rev_geocoder_concurrency)
+geocoder_scheduler = GeocoderScheduler(
+    rate_per_s=settings.geocoder_rate_limit_rps,
+    burst=settings.geocoder_burst,
+    initial_concurrency=settings.rev_geocoder_concurrency,
+    min_concurrency=settings.geocoder_min_concurrency,
+    max_concurrency=settings.geocoder_max_concurrency,
+    target_latency_s=settings.geocoder_target_latency_s,
+    max_retries=settings.geocoder_max_retries,
+    backoff_base_s=settings.geocoder_backoff_base_s,
+    backoff_max_s=settings.geocoder_backoff_max_s,
+)
+
+rev_cache = TieredCache(
+    "geocode_reverse",
+    memory=TTLCache(max_entries=settings.rev_geocode_cache_memory_entries, ttl_s=settings.rev_geocode_cache_ttl_s),
+    disk=(
+        SqliteCache(
+            settings.geocode_cache_path,
+            "reverse",
+            max_entries=settings.rev_geocode_cache_disk_entries,
+        )
+        if settings.geocode_cache_path
+        else None
+    ),
+)
+
+fwd_cache = TieredCache(
+    "geocode_forward",
+    memory=TTLCache(max_entries=settings.fwd_geocode_cache_memory_entries, ttl_s=settings.fwd_geocode_cache_ttl_s),
+    disk=(
+        SqliteCache(
+            settings.geocode_cache_path,
+            "forward",
+            max_entries=settings.fwd_geocode_cache_disk_entries,
+        )
+        if settings.geocode_cache_path
+        else None
+    ),
+)
+
+
+@registry.collector
+def _scheduler_metrics() -> Iterable[Family]:
+    stats = geocoder_scheduler.stats()
+    yield "geocoder_concurrency", "gauge", "Current AIMD concurrency limit", [({}, stats["concurrency"])]
+    yield "geocoder_in_flight", "gauge", "Geocoder calls in flight", [({}, stats["in_flight"])]
+    yield "geocoder_waiting", "gauge", "Geocoder calls waiting for a slot", [({}, stats["waiting"])]
+    yield "geocoder_throttled_total", "counter", "Geocoder HTTP 429 responses", [({}, stats["throttled"])]
+    yield "geocoder_retries_total", "counter", "Geocoder call retries", [({}, stats["retries"])]
+
+
+# Обращения к геокодеру (с повторами) в пределах текущего запроса /route
+geocode_calls = ScopedCounter("geocode_calls")
+
+_punct_re = re.compile(r"[^\w]+", re.UNICODE)
+
+
+def normalize_address(address: str) -> str:
+    """Ключ кеша прямого геокодирования: регистр, ё/е, пунктуация и пробелы не различаются."""
+    s = address.casefold().replace("ё", "е")
+    return " ".join(_punct_re.sub(" ", s).split())
+
+
+def _snap(x: float, grid: float) -> str:
+    # Квантуем координату к сетке, чтобы соседние точки (в пределах ячейки) делили запись кеша
+    return f"{round(x / grid) * grid:.6f}"
+
+
+def reverse_cache_key(lat: float, lon: float, kind: Optional[str]) -> str:
+    grid = settings.rev_geocode_cache_grid_deg
+    return f"{kind or '-'}:{_snap(lat, grid)}:{_snap(lon, grid)}"
+
+
+async def _send(params: Dict[str, Any], upstream: str) -> httpx.Response:
+    geocode_calls.inc()
+    try:
+        with upstream_seconds.time(upstream):
+            r = await geocoder_client.get(settings.yandex_geocoder_url, params=params)
+    except Exception:
+        upstream_errors.inc(upstream)
+        raise
+    if r.status_code != 200:
+        upstream_errors.inc(upstream)
+    return r
 
 
 async def geocode_forward(address: str) -> Tuple[float, float]:
+    key = normalize_address(address)
+    cached = await fwd_cache.aget(key)
+    if cached is not MISSING:
+        if cached is None:
+            logger.debug("Yandex forward geocode: cached 'not found' for {!r}", address)
+            raise HTTPException(422, f"Не удалось геокодировать адрес: {address!r}")
+        lat, lon = cached
+        return lat, lon
+
+    try:
+        lat, lon = await _geocode_forward_remote(address)
+    except HTTPException as he:
+        if he.status_code == 422:
+            fwd_cache.set(key, None, ttl_s=settings.fwd_geocode_cache_negative_ttl_s)
+        raise
+    fwd_cache.set(key, [lat, lon])
+    return lat, lon
+
+
+async def _geocode_forward_remote(address: str) -> Tuple[float, float]:
     params = {
         "apikey": settings.yandex_geocoder_api_key,
         "geocode": address,
@@ -18,14 +126,14 @@ async def geocode_forward(address: str) -> Tuple[float, float]:
         "results": 1,
         "format": "json",
     }
-    logger.debug("Yandex forward geocode: %s", address)
-    r = await geocoder_client.get(settings.yandex_geocoder_url, params=params)
+    logger.debug("Yandex forward geocode: {}", address)
+    r = await geocoder_scheduler.request(lambda: _send(params, "geocode_forward"), PRIORITY_FORWARD)
     if r.status_code != 200:
         _msg = safe_http_error_message(r)
-        logger.info("Yandex forward geocode HTTP %s: %s", r.status_code, _msg)
+        logger.info("Yandex forward geocode HTTP {}: {}", r.status_code, _msg)
         raise HTTPException(r.status_code, f"Geocoder forward error: {_msg}")
 
-    data = r.json()
+    data = loads(r.content)
     try:
         member = data["response"]["GeoObjectCollection"]["featureMember"][0]["GeoObject"]
         pos = member["Point"]["pos"]  # "lon lat"
@@ -39,11 +147,46 @@ async def geocode_forward(address: str) -> Tuple[float, float]:
         lon, lat = feat["geometry"]["coordinates"]
         return float(lat), float(lon)
     except Exception as e:
-        logger.info("Yandex forward geocode failed to parse response: %s", e)
+        logger.info("Yandex forward geocode failed to parse response: {}", e)
         raise HTTPException(422, f"Не удалось геокодировать адрес: {address!r}. Детали: {e}")
 
 
-async def geocode_reverse(lat: float, lon: float, kind: Optional[str] = None) -> Dict[str, str]:
+def _parse_envelope(member: Dict[str, Any]) -> Optional[List[float]]:
+    """``boundedBy`` → ``[min_lat, min_lon, max_lat, max_lon]`` (Yandex отдаёт углы как "lon lat")."""
+    try:
+        env = member["boundedBy"]["Envelope"]
+        lo_lon, lo_lat = (float(x) for x in env["lowerCorner"].split())
+        up_lon, up_lat = (float(x) for x in env["upperCorner"].split())
+        return [lo_lat, lo_lon, up_lat, up_lon]
+    except Exception:
+        return None
+
+
+async def geocode_reverse(
+    lat: float,
+    lon: float,
+    kind: Optional[str] = None,
+    priority: int = PRIORITY_STEP,
+    skip: Optional[Callable[[], bool]] = None,
+) -> Dict[str, Any]:
+    """Обратное геокодирование с кешем. ``skip`` передаётся планировщику: если он сработал
+    перед запросом, возвращается ``{}`` без записи в кеш."""
+    key = reverse_cache_key(lat, lon, kind)
+    cached = await rev_cache.aget(key)
+    if cached is not MISSING:
+        return cached
+
+    out = await _geocode_reverse_remote(lat, lon, kind, priority, skip)
+    if out is None:
+        # Ошибки HTTP (и отменённые через skip запросы) не кешируем — следующий запрос попробует снова
+        return {}
+    rev_cache.set(key, out)
+    return out
+
+
+async def _geocode_reverse_remote(
+    lat: float, lon: float, kind: Optional[str], priority: int, skip: Optional[Callable[[], bool]] = None
+) -> Optional[Dict[str, Any]]:
     params = {
         "apikey": settings.yandex_geocoder_api_key,
         "geocode": f"{lat},{lon}",
@@ -55,14 +198,15 @@ async def geocode_reverse(lat: float, lon: float, kind: Optional[str] = None) ->
     if kind:
         params["kind"] = kind
 
-    async with _rev_sem:
-        r = await geocoder_client.get(settings.yandex_geocoder_url, params=params)
+    r = await geocoder_scheduler.request(lambda: _send(params, "geocode_reverse"), priority, skip=skip)
+    if r is None:
+        return None
 
     if r.status_code != 200:
-        logger.info("Yandex reverse geocode HTTP %s", r.status_code)
-        return {}
+        logger.info("Yandex reverse geocode HTTP {}", r.status_code)
+        return None
 
-    data = r.json()
+    data = loads(r.content)
     try:
         member = data["response"]["GeoObjectCollection"]["featureMember"][0]["GeoObject"]
         addr = member["metaDataProperty"]["GeocoderMetaData"]["Address"]
@@ -71,6 +215,9 @@ async def geocode_reverse(lat: float, lon: float, kind: Optional[str] = None) ->
         full_text = addr.get("formatted")
         out = {"name": name, "full": full_text}
         out.update(comps)
+        envelope = _parse_envelope(member)
+        if envelope:
+            out["envelope"] = envelope
         return out
     except Exception:
         pass
@@ -88,3 +235,9 @@ async def geocode_reverse(lat: float, lon: float, kind: Optional[str] = None) ->
     except Exception:
         logger.debug("Yandex reverse geocode: no components found")
         return {}
+
+
+def close_geocoder_caches() -> None:
+    for cache in (fwd_cache, rev_cache):
+        logger.info("Cache {} stats: {}", cache.name, cache.stats())
+        cache.close()
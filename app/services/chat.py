@@ -1,13 +1,21 @@
+import asyncio
 import uuid
 from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import openai
 
 from app.integration.chatgpt import OpenAIClient
-from app.services.conversation_store import ConversationStore
+from app.services.conversation_store import ConversationBackend
+from app.utils.fastjson import dumps
 from app.utils.prompt_loader import PromptLoader
+from app.utils.tokens import count_tokens
 from app.config import logger
 
+# Служебные токены роли/разметки на каждое сообщение в запросе
+_MESSAGE_OVERHEAD_TOKENS = 4
+
 
 def utcnow_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
@@ -20,6 +28,16 @@ class ChatResult:
     response_id: Optional[str]
 
 
+@dataclass
+class _TurnPlan:
+    conv_id: str
+    system_prompt: str
+    # окно истории для полного повтора; в режиме цепочки читается только при обрыве цепочки
+    history: Optional[List[Dict[str, Any]]]
+    user_text: str
+    previous_response_id: Optional[str]
+
+
 class ChatService:
     """Сервис диалогов: строит сообщения, вызывает модель и логирует историю."""
 
@@ -27,15 +45,68 @@ class ChatService:
         self,
         client: OpenAIClient,
         prompt_loader: PromptLoader,
-        store: ConversationStore,
+        store: ConversationBackend,
         max_history_messages: Optional[int] = None,
+        max_history_tokens: Optional[int] = None,
+        chain_responses: bool = False,
     ):
-        logger.debug(f"ChatService.__init__ model={client.model_name} max_history={max_history_messages}")
+        logger.debug(
+            "ChatService.__init__ model={} max_history={} max_history_tokens={}",
+            client.model_name,
+            max_history_messages,
+            max_history_tokens,
+        )
         self.client = client
         self.prompt_loader = prompt_loader
         self.store = store
         self.max_history_messages = max_history_messages
+        self.max_history_tokens = max_history_tokens
+        # Режим цепочки: отправляем только новую реплику с previous_response_id,
+        # полная история уходит лишь если цепочка оборвана или истекла
+        self.chain_responses = chain_responses
         self.model_name = client.model_name
+        self.stats: Dict[str, int] = {
+            "requests": 0,
+            "chained": 0,
+            "replayed": 0,
+            "chain_fallbacks": 0,
+            "payload_bytes": 0,
+        }
+
+    def _message_tokens(self, m: Dict[str, Any]) -> int:
+        # Старые записи без счётчика считаем один раз: запись из кеша хранилища запоминает результат
+        tokens = m.get("tokens")
+        if tokens is None:
+            tokens = m["tokens"] = count_tokens(str(m.get("content", "")), self.model_name)
+        return tokens + _MESSAGE_OVERHEAD_TOKENS
+
+    def _trim_to_budget(self, history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Самый длинный хвост истории, укладывающийся в ``max_history_tokens``."""
+        if self.max_history_tokens is None:
+            return history
+        used = 0
+        start = len(history)
+        for i in range(len(history) - 1, -1, -1):
+            m = history[i]
+            if m.get("role") not in {"user", "assistant"}:
+                continue
+            cost = self._message_tokens(m)
+            if used + cost > self.max_history_tokens:
+                break
+            used += cost
+            start = i
+        return history[start:]
+
+    def _load_history(self, conv_id: str) -> List[Dict[str, Any]]:
+        if self.max_history_tokens is None or self.max_history_messages is not None:
+            return self.store.load(conv_id, limit=self.max_history_messages)
+        # Только бюджет токенов: читаем хвост с запасом и расширяем окно, пока бюджет не исчерпан
+        limit = 64
+        while True:
+            history = self.store.load(conv_id, limit=limit)
+            if len(history) < limit or len(self._trim_to_budget(history)) < len(history):
+                return history
+            limit *= 4
 
     def _build_messages(self, system_prompt: str, history: List[Dict[str, Any]], new_user_text: str):
         msgs: List[Dict[str, Any]] = []
@@ -45,11 +116,8 @@ class ChatService:
                 "content": [{"type": "input_text", "text": system_prompt}],
             }
         )
-        hist = history
-        if self.max_history_messages is not None and len(history) > self.max_history_messages:
-            hist = history[-self.max_history_messages :]
 
-        for m in hist:
+        for m in history:
             if m.get("role") in {"user", "assistant"}:
                 content_type = "input_text" if m["role"] == "user" else "output_text"
                 msgs.append(
@@ -67,22 +135,63 @@ class ChatService:
         )
         return msgs
 
-    def chat(self, user_text: str, conversation_id: Optional[str] = None) -> ChatResult:
+    def _prepare(self, user_text: str, conversation_id: Optional[str]) -> "_TurnPlan":
         conv_id = conversation_id or str(uuid.uuid4())
-        logger.info(f"ChatService.chat conversation_id={conv_id}")
+        logger.info("ChatService.chat conversation_id={}", conv_id)
         system_prompt = self.prompt_loader.load()
-        logger.debug(f"System prompt loaded ({len(system_prompt)} chars)")
-        history = self.store.load(conv_id)
-        logger.debug(f"Loaded history messages: {len(history)}")
+        logger.debug("System prompt loaded ({} chars)", len(system_prompt))
+        previous_response_id = None
+        history: Optional[List[Dict[str, Any]]] = None
+        if self.chain_responses:
+            # Для цепочки нужна только последняя запись: она цела, если последний ход
+            # завершился ответом модели с известным id
+            last = self.store.load(conv_id, limit=1)
+            if last and last[-1].get("role") == "assistant" and last[-1].get("response_id"):
+                previous_response_id = last[-1]["response_id"]
+            elif not last:
+                history = []
+        plan = _TurnPlan(conv_id, system_prompt, history, user_text, previous_response_id)
+        if previous_response_id is None:
+            self._ensure_history(plan)
+        return plan
 
-        msgs = self._build_messages(system_prompt, history, user_text)
-        logger.debug(f"Built messages: {len(msgs)}")
+    def _ensure_history(self, plan: "_TurnPlan") -> None:
+        """Читает и обрезает окно истории для полного повтора, если оно ещё не прочитано.
 
-        resp = self.client.create(msgs)
-        assistant_text = resp.output_text
-        response_id = getattr(resp, "id", None)
-        logger.info(f"OpenAI response id={response_id} (len={len(assistant_text or '')})")
+        Подсчёт токенов идёт здесь, а не в ``_build_messages``: асинхронные пути вызывают
+        этот метод в worker-потоке, и event loop не токенизирует историю.
+        """
+        if plan.history is None:
+            history = self._load_history(plan.conv_id)
+            if self.max_history_messages is not None and len(history) > self.max_history_messages:
+                history = history[-self.max_history_messages :]
+            plan.history = self._trim_to_budget(history)
+            logger.debug("Loaded history messages: {}", len(plan.history))
+
+    def _request(self, plan: "_TurnPlan", chained: bool) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        if chained:
+            msgs = [{"role": "user", "content": [{"type": "input_text", "text": plan.user_text}]}]
+            prev = plan.previous_response_id
+        else:
+            msgs = self._build_messages(plan.system_prompt, plan.history or [], plan.user_text)
+            prev = None
+        payload_bytes = len(dumps(msgs))
+        self.stats["requests"] += 1
+        self.stats["chained" if chained else "replayed"] += 1
+        self.stats["payload_bytes"] += payload_bytes
+        logger.debug("Built messages: {} chained={} payload_bytes={}", len(msgs), chained, payload_bytes)
+        return msgs, prev
 
+    def _chain_broken(self, plan: "_TurnPlan", e: Exception) -> bool:
+        if isinstance(e, openai.NotFoundError) or (
+            isinstance(e, openai.BadRequestError) and "previous_response" in str(e)
+        ):
+            self.stats["chain_fallbacks"] += 1
+            logger.info("previous_response_id={} rejected ({}); replaying full history", plan.previous_response_id, e)
+            return True
+        return False
+
+    def _persist_turn(self, conv_id: str, user_text: str, assistant_text: str, response_id: Optional[str]) -> None:
         user_msg = {
             "id": str(uuid.uuid4()),
             "conversation_id": conv_id,
@@ -91,10 +200,8 @@ class ChatService:
             "ts": utcnow_iso(),
             "model": None,
             "response_id": None,
+            "tokens": count_tokens(user_text, self.model_name),
         }
-        self.store.append(conv_id, user_msg)
-        logger.debug("Appended user message to store")
-
         assistant_msg = {
             "id": str(uuid.uuid4()),
             "conversation_id": conv_id,
@@ -103,12 +210,96 @@ class ChatService:
             "ts": utcnow_iso(),
             "model": self.model_name,
             "response_id": response_id,
+            "tokens": count_tokens(assistant_text or "", self.model_name),
         }
-        self.store.append(conv_id, assistant_msg)
-        logger.debug("Appended assistant message to store")
+        self.store.append_many(conv_id, [user_msg, assistant_msg])
+        logger.debug("Appended user and assistant messages to store")
+
+    def chat(self, user_text: str, conversation_id: Optional[str] = None) -> ChatResult:
+        plan = self._prepare(user_text, conversation_id)
+        conv_id = plan.conv_id
 
+        chained = plan.previous_response_id is not None
+        try:
+            resp = self.client.create(*self._request(plan, chained))
+        except openai.APIStatusError as e:
+            if not (chained and self._chain_broken(plan, e)):
+                raise
+            self._ensure_history(plan)
+            resp = self.client.create(*self._request(plan, False))
+        assistant_text = resp.output_text
+        response_id = getattr(resp, "id", None)
+        logger.info("OpenAI response id={} (len={})", response_id, len(assistant_text or ""))
+
+        self._persist_turn(conv_id, user_text, assistant_text, response_id)
         return ChatResult(
             conversation_id=conv_id,
             assistant_text=assistant_text,
             response_id=response_id,
         )
+
+    async def achat(self, user_text: str, conversation_id: Optional[str] = None) -> ChatResult:
+        """То же, что :meth:`chat`, но без блокировки потока: модель — через async-клиент,
+        файловое хранилище — в threadpool."""
+        plan = await asyncio.to_thread(self._prepare, user_text, conversation_id)
+        conv_id = plan.conv_id
+
+        chained = plan.previous_response_id is not None
+        try:
+            resp = await self.client.acreate(*self._request(plan, chained))
+        except openai.APIStatusError as e:
+            if not (chained and self._chain_broken(plan, e)):
+                raise
+            await asyncio.to_thread(self._ensure_history, plan)
+            resp = await self.client.acreate(*self._request(plan, False))
+        assistant_text = resp.output_text
+        response_id = getattr(resp, "id", None)
+        logger.info("OpenAI response id={} (len={})", response_id, len(assistant_text or ""))
+
+        await asyncio.to_thread(self._persist_turn, conv_id, user_text, assistant_text, response_id)
+        return ChatResult(
+            conversation_id=conv_id,
+            assistant_text=assistant_text,
+            response_id=response_id,
+        )
+
+    async def achat_stream(
+        self, user_text: str, conversation_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Потоковый ответ: события ``start`` → ``delta``… → ``done``.
+
+        История пишется в хранилище один раз, после завершения потока; оборванный
+        поток (ошибка или отключение клиента) в историю не попадает.
+        """
+        plan = await asyncio.to_thread(self._prepare, user_text, conversation_id)
+        conv_id = plan.conv_id
+        yield {"type": "start", "conversation_id": conv_id}
+
+        parts: List[str] = []
+        response_id: Optional[str] = None
+        final_text: Optional[str] = None
+        chained = plan.previous_response_id is not None
+        while True:
+            try:
+                async for event in self.client.astream(*self._request(plan, chained)):
+                    etype = getattr(event, "type", "")
+                    if etype == "response.output_text.delta":
+                        parts.append(event.delta)
+                        yield {"type": "delta", "text": event.delta}
+                    elif etype == "response.completed":
+                        response_id = getattr(event.response, "id", None)
+                        final_text = event.response.output_text
+                    elif etype in ("response.failed", "error"):
+                        raise RuntimeError(f"OpenAI stream failed: {getattr(event, 'message', None) or etype}")
+                break
+            except openai.APIStatusError as e:
+                # ошибка цепочки приходит до первого события — повтор с полной историей безопасен
+                if parts or not (chained and self._chain_broken(plan, e)):
+                    raise
+                await asyncio.to_thread(self._ensure_history, plan)
+                chained = False
+
+        assistant_text = final_text if final_text is not None else "".join(parts)
+        logger.info("OpenAI streamed response id={} (len={})", response_id, len(assistant_text))
+        await asyncio.to_thread(self._persist_turn, conv_id, user_text, assistant_text, response_id)
+        yield {"type": "done", "conversation_id": conv_id, "response_id": response_id}
@@ -0,0 +1,134 @@
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import logger
+from app.services.conversation_store import ConversationBackend
+from app.utils.fastjson import dumps_str, loads
+
+_SYNCHRONOUS = {"off": "OFF", "normal": "NORMAL", "full": "FULL"}
+
+
+def init_schema(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS messages ("
+        "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "conversation_id TEXT NOT NULL, "
+        "ts TEXT, "
+        "record TEXT NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS messages_conv_seq ON messages(conversation_id, seq)")
+    conn.execute("CREATE INDEX IF NOT EXISTS messages_conv_ts ON messages(conversation_id, ts)")
+
+
+def connect(path: Path, synchronous: str = "normal") -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={_SYNCHRONOUS.get(synchronous.lower(), 'NORMAL')}")
+    init_schema(conn)
+    conn.commit()
+    return conn
+
+
+class SqliteConversationStore(ConversationBackend):
+    """
+    История диалогов в одной SQLite-базе (WAL) с отложенной пакетной записью.
+
+    ``append`` только ставит записи в очередь; фоновый поток сбрасывает её одной
+    транзакцией раз в ``flush_interval_s`` или по набору ``batch_size`` записей.
+    Чтение видит и ещё не сброшенные записи. Надёжность записи на диск задаётся
+    ``synchronous`` (``off`` | ``normal`` | ``full`` — как PRAGMA synchronous):
+    при ``normal`` в режиме WAL после сбоя питания можно потерять последние транзакции.
+    """
+
+    backend = "sqlite"
+
+    def __init__(
+        self,
+        path: Path,
+        synchronous: str = "normal",
+        flush_interval_s: float = 0.05,
+        batch_size: int = 256,
+        cache_size: int = 1024,
+        cache_window: int = 200,
+    ):
+        super().__init__(cache_size=cache_size, cache_window=cache_window)
+        self.path = path
+        self.flush_interval_s = flush_interval_s
+        self.batch_size = batch_size
+        self._conn = connect(path, synchronous)
+        # очередь ещё не записанных (conversation_id, record) и блокировка БД/очереди
+        self._pending: List[Tuple[str, Dict[str, Any]]] = []
+        self._db_lock = threading.Lock()
+        self._wakeup = threading.Condition(threading.Lock())
+        self._closed = False
+        self._writer = threading.Thread(target=self._run_writer, name="conversation-writer", daemon=True)
+        self._writer.start()
+
+    def _write(self, conversation_id: str, records: List[Dict[str, Any]]) -> None:
+        with self._db_lock:
+            self._pending.extend((conversation_id, r) for r in records)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            with self._wakeup:
+                self._wakeup.notify()
+
+    def _read(self, conversation_id: str, limit: Optional[int]) -> Tuple[List[Dict[str, Any]], bool]:
+        with self._db_lock:
+            if limit is None:
+                rows = self._conn.execute(
+                    "SELECT record FROM messages WHERE conversation_id = ? ORDER BY seq", (conversation_id,)
+                ).fetchall()
+                complete = True
+            else:
+                rows = self._conn.execute(
+                    "SELECT record FROM messages WHERE conversation_id = ? ORDER BY seq DESC LIMIT ?",
+                    (conversation_id, limit),
+                ).fetchall()[::-1]
+                complete = len(rows) < limit
+            pending = [r for cid, r in self._pending if cid == conversation_id]
+        records = [loads(row[0]) for row in rows] + pending
+        if limit is not None and len(records) > limit:
+            records, complete = records[-limit:], False
+        return records, complete
+
+    def flush(self) -> int:
+        """Сбрасывает очередь в БД одной транзакцией; возвращает число записей."""
+        with self._db_lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT INTO messages (conversation_id, ts, record) VALUES (?, ?, ?)",
+                        [(cid, r.get("ts"), dumps_str(r)) for cid, r in batch],
+                    )
+            except sqlite3.Error:
+                # вернуть пачку в начало очереди — попробуем в следующий раз
+                self._pending = batch + self._pending
+                raise
+        return len(batch)
+
+    def _run_writer(self) -> None:
+        while True:
+            with self._wakeup:
+                if not self._closed:
+                    self._wakeup.wait(self.flush_interval_s)
+                closed = self._closed
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error("Conversation store flush failed: {}", e)
+            if closed:
+                return
+
+    def close(self) -> None:
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify()
+        self._writer.join()
+        with self._db_lock:
+            self._conn.close()
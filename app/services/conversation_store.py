@@ -1,28 +1,203 @@
-import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+from app.utils.fastjson import dumps, loads
+from app.utils.metrics import Histogram
 
-class ConversationStore:
+_TAIL_CHUNK = 64 * 1024
+
+store_seconds = Histogram(
+    "conversation_store_seconds",
+    "Conversation store operation latency",
+    ["backend", "op"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+
+class ConversationBackend:
+    """
+    Базовый класс хранилищ истории диалогов.
+
+    Недавно активные диалоги держатся в LRU-кеше «хвостов», который ``append``
+    поддерживает в актуальном состоянии. Наследники реализуют только ``_read``
+    (последние ``limit`` записей с диска) и ``_write``.
+
+    Запись и чтение с диска одного диалога идут под его собственной блокировкой,
+    общая ``_lock`` держится лишь на время работы с кешем — медленная запись в один
+    диалог не задерживает остальные.
+    """
+
+    backend = "base"  # метка в метриках
+
+    def __init__(self, cache_size: int = 1024, cache_window: int = 200):
+        self.cache_size = cache_size
+        self.cache_window = cache_window
+        # conversation_id → (последние записи, содержит ли список всю историю)
+        self._cache: "OrderedDict[str, Tuple[List[Dict[str, Any]], bool]]" = OrderedDict()
+        # conversation_id → [блокировка диалога, число её пользователей]; запись удаляется,
+        # когда блокировка никому не нужна, так что таблица не растёт с числом диалогов
+        self._conv_locks: Dict[str, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def _read(self, conversation_id: str, limit: Optional[int]) -> Tuple[List[Dict[str, Any]], bool]:
+        """Последние ``limit`` записей (все при ``None``) и флаг «прочитана вся история»."""
+        raise NotImplementedError
+
+    def _write(self, conversation_id: str, records: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    @contextmanager
+    def _conversation_lock(self, conversation_id: str) -> Iterator[None]:
+        with self._lock:
+            entry = self._conv_locks.get(conversation_id)
+            if entry is None:
+                entry = self._conv_locks[conversation_id] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._conv_locks[conversation_id]
+
+    def load(self, conversation_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        with store_seconds.time(self.backend, "load"):
+            return self._load(conversation_id, limit)
+
+    def _cached(self, conversation_id: str, limit: Optional[int]) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            cached = self._cache.get(conversation_id)
+            if cached is not None:
+                records, complete = cached
+                if complete or (limit is not None and len(records) >= limit):
+                    self._cache.move_to_end(conversation_id)
+                    return list(records[-limit:] if limit else records)
+        return None
+
+    def _load(self, conversation_id: str, limit: Optional[int]) -> List[Dict[str, Any]]:
+        records = self._cached(conversation_id, limit)
+        if records is not None:
+            return records
+        # под блокировкой диалога append не вклинится между чтением и записью в кеш
+        with self._conversation_lock(conversation_id):
+            records = self._cached(conversation_id, limit)
+            if records is not None:
+                return records
+            records, complete = self._read(conversation_id, limit)
+            self._remember(conversation_id, records, complete)
+        return records[-limit:] if limit else records
+
+    def _remember(self, conversation_id: str, records: List[Dict[str, Any]], complete: bool) -> None:
+        if self.cache_size <= 0:
+            return
+        if len(records) > self.cache_window:
+            records, complete = records[-self.cache_window :], False
+        with self._lock:
+            self._cache[conversation_id] = (list(records), complete)
+            self._cache.move_to_end(conversation_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def append(self, conversation_id: str, record: Dict[str, Any]) -> None:
+        self.append_many(conversation_id, [record])
+
+    def append_many(self, conversation_id: str, records: List[Dict[str, Any]]) -> None:
+        """Записывает несколько записей одной операцией (например, реплики одного хода)."""
+        with store_seconds.time(self.backend, "append"), self._conversation_lock(conversation_id):
+            # параллельные ходы одного диалога не перемешиваются, другие диалоги не ждут
+            self._write(conversation_id, records)
+            with self._lock:
+                cached = self._cache.get(conversation_id)
+                if cached is not None:
+                    tail, complete = cached
+                    tail.extend(records)
+                    if len(tail) > self.cache_window:
+                        del tail[: len(tail) - self.cache_window]
+                        complete = False
+                    self._cache[conversation_id] = (tail, complete)
+                    self._cache.move_to_end(conversation_id)
+
+    def close(self) -> None:
+        pass
+
+
+class ConversationStore(ConversationBackend):
     """
     Простое файловое хранилище истории в формате JSONL (по одному файлу на диалог).
+
+    ``load(..., limit=N)`` читает файл с конца и разбирает только последние N записей —
+    стоимость загрузки O(окно), а не O(история).
     """
 
-    def __init__(self, base_dir: Path):
+    backend = "jsonl"
+
+    def __init__(self, base_dir: Path, cache_size: int = 1024, cache_window: int = 200):
+        super().__init__(cache_size=cache_size, cache_window=cache_window)
         self.base_dir = base_dir
         self.base_dir.mkdir(parents=True, exist_ok=True)
 
     def _path_for(self, conversation_id: str) -> Path:
         return self.base_dir / f"{conversation_id}.jsonl"
 
-    def load(self, conversation_id: str) -> List[Dict[str, Any]]:
+    def _read(self, conversation_id: str, limit: Optional[int]) -> Tuple[List[Dict[str, Any]], bool]:
         p = self._path_for(conversation_id)
         if not p.exists():
-            return []
-        lines = p.read_text(encoding="utf-8").splitlines()
-        return [json.loads(x) for x in lines if x.strip()]
+            return [], True
+        if limit is None:
+            lines = p.read_bytes().splitlines()
+            return [loads(x) for x in lines if x.strip()], True
+        return self._read_tail(p, limit)
 
-    def append(self, conversation_id: str, record: Dict[str, Any]) -> None:
+    def _read_tail(self, p: Path, n: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """Последние ``n`` записей файла; второй элемент — прочитан ли файл целиком."""
+        if n <= 0:
+            return [], False
+        with p.open("rb") as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            buf = b""
+            while pos > 0 and buf.count(b"\n") <= n:
+                step = min(_TAIL_CHUNK, pos)
+                pos -= step
+                f.seek(pos)
+                buf = f.read(step) + buf
+        lines = [x for x in buf.split(b"\n") if x.strip()]
+        if pos > 0:
+            # первая строка буфера может быть обрезана — её не разбираем
+            lines = lines[1:]
+        tail = lines[-n:]
+        complete = pos == 0 and len(tail) == len(lines)
+        return [loads(x) for x in tail], complete
+
+    def _write(self, conversation_id: str, records: List[Dict[str, Any]]) -> None:
         p = self._path_for(conversation_id)
-        with p.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        with p.open("ab") as f:
+            f.write(b"".join(dumps(r) + b"\n" for r in records))
+
+
+def create_conversation_store(settings) -> ConversationBackend:
+    """Хранилище истории по ``settings.conversation_backend`` (``jsonl`` | ``sqlite``)."""
+    if settings.conversation_backend == "sqlite":
+        from app.services.conversation_sqlite import SqliteConversationStore
+
+        return SqliteConversationStore(
+            settings.conversations_db_path,
+            synchronous=settings.conversation_sqlite_synchronous,
+            flush_interval_s=settings.conversation_flush_interval_s,
+            batch_size=settings.conversation_batch_size,
+            cache_size=settings.conversation_cache_size,
+            cache_window=settings.conversation_cache_window,
+        )
+    if settings.conversation_backend != "jsonl":
+        raise ValueError(f"Unknown conversation_backend: {settings.conversation_backend!r}")
+    return ConversationStore(
+        settings.conversations_dir,
+        cache_size=settings.conversation_cache_size,
+        cache_window=settings.conversation_cache_window,
+    )
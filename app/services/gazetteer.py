@@ -0,0 +1,164 @@
+"""Локальный справочник населённых пунктов — первый уровень перед обратным геокодированием.
+
+Набор (CSV ``name,lat,lon[,population]`` или GeoJSON с точками/полигонами и
+свойствами ``name``, ``population``) загружается при старте в сеточный индекс на
+NumPy. Точка относится к пункту, если лежит внутри его полигона или в пределах
+радиуса от центра; радиус растёт с населением (``k·√population``) в рамках
+``[gazetteer_radius_m, gazetteer_max_radius_m]``. Промахи уходят в Yandex.
+"""
+
+import csv
+import math
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config import logger, settings
+from app.utils.fastjson import loads
+from app.utils.metrics import stats_collector
+from app.utils.route_geometry import EARTH_RADIUS_M, haversine_np
+
+Ring = np.ndarray  # (n, 2): lon, lat
+
+
+def _point_in_rings(lat: float, lon: float, rings: Sequence[Ring]) -> bool:
+    """Чётно-нечётное правило по всем кольцам (внешние и дыры) полигона."""
+    inside = False
+    for ring in rings:
+        x0, y0 = ring[:, 0], ring[:, 1]
+        x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+        crosses = (y0 > lat) != (y1 > lat)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_at = x0 + (lat - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= bool(np.count_nonzero(crosses & (lon < x_at)) % 2)
+    return inside
+
+
+class Gazetteer:
+    def __init__(self, cell_deg: float = 0.1):
+        self.cell_deg = cell_deg
+        self.names: List[str] = []
+        self.lat = np.empty(0)
+        self.lon = np.empty(0)
+        self.radius_m = np.empty(0)
+        self._polygons: Dict[int, List[Ring]] = {}
+        self._cells: Dict[Tuple[int, int], np.ndarray] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def load(self, path: Path) -> None:
+        if path.suffix.lower() in (".geojson", ".json"):
+            rows = self._read_geojson(path)
+        else:
+            rows = self._read_csv(path)
+        self.build(rows)
+        logger.info("Gazetteer loaded: {} settlements ({} polygons) from {}", len(self), len(self._polygons), path)
+
+    @staticmethod
+    def _read_csv(path: Path) -> List[Tuple[str, float, float, int, Optional[List[Ring]]]]:
+        rows = []
+        with path.open(encoding="utf-8", newline="") as f:
+            for r in csv.DictReader(f):
+                pop = r.get("population") or 0
+                rows.append((r["name"], float(r["lat"]), float(r["lon"]), int(float(pop)), None))
+        return rows
+
+    @staticmethod
+    def _read_geojson(path: Path) -> List[Tuple[str, float, float, int, Optional[List[Ring]]]]:
+        rows = []
+        for feat in loads(path.read_bytes()).get("features", []):
+            props: Dict[str, Any] = feat.get("properties") or {}
+            geom = feat.get("geometry") or {}
+            name = props.get("name")
+            if not name:
+                continue
+            pop = int(props.get("population") or 0)
+            gtype, coords = geom.get("type"), geom.get("coordinates")
+            if gtype == "Point":
+                rows.append((name, float(coords[1]), float(coords[0]), pop, None))
+                continue
+            polys = [coords] if gtype == "Polygon" else coords if gtype == "MultiPolygon" else []
+            rings = [np.asarray(ring, dtype=np.float64)[:, :2] for poly in polys for ring in poly]
+            if not rings:
+                continue
+            # центр — по внешнему кольцу (или из свойств, если задан явно)
+            outer = rings[0]
+            lat = float(props.get("lat", outer[:, 1].mean()))
+            lon = float(props.get("lon", outer[:, 0].mean()))
+            rows.append((name, lat, lon, pop, rings))
+        return rows
+
+    def build(self, rows: Sequence[Tuple[str, float, float, int, Optional[List[Ring]]]]) -> None:
+        self.names = [r[0] for r in rows]
+        self.lat = np.array([r[1] for r in rows], dtype=np.float64)
+        self.lon = np.array([r[2] for r in rows], dtype=np.float64)
+        pop = np.array([r[3] for r in rows], dtype=np.float64)
+        self.radius_m = np.clip(
+            settings.gazetteer_radius_per_sqrt_pop_m * np.sqrt(pop),
+            settings.gazetteer_radius_m,
+            settings.gazetteer_max_radius_m,
+        )
+        self._polygons = {i: r[4] for i, r in enumerate(rows) if r[4]}
+
+        # Пункт регистрируется во всех ячейках, которые задевает его круг (или bbox полигона),
+        # поэтому при поиске достаточно одной ячейки точки
+        c = self.cell_deg
+        cells: Dict[Tuple[int, int], List[int]] = {}
+        for i in range(len(rows)):
+            if i in self._polygons:
+                pts = np.concatenate(self._polygons[i])
+                min_lon, min_lat = pts.min(axis=0)
+                max_lon, max_lat = pts.max(axis=0)
+            else:
+                d_lat = math.degrees(self.radius_m[i] / EARTH_RADIUS_M)
+                d_lon = d_lat / max(0.01, math.cos(math.radians(self.lat[i])))
+                min_lat, max_lat = self.lat[i] - d_lat, self.lat[i] + d_lat
+                min_lon, max_lon = self.lon[i] - d_lon, self.lon[i] + d_lon
+            for ci in range(int(min_lat // c), int(max_lat // c) + 1):
+                for cj in range(int(min_lon // c), int(max_lon // c) + 1):
+                    cells.setdefault((ci, cj), []).append(i)
+        self._cells = {k: np.array(v, dtype=np.int64) for k, v in cells.items()}
+
+    def lookup(self, lat: float, lon: float) -> Optional[str]:
+        """Ближайший пункт, покрывающий точку; полигон, содержащий точку, важнее радиуса."""
+        cand = self._cells.get((int(lat // self.cell_deg), int(lon // self.cell_deg)))
+        if cand is None:
+            self.misses += 1
+            return None
+        for i in cand.tolist():
+            rings = self._polygons.get(i)
+            if rings is not None and _point_in_rings(lat, lon, rings):
+                self.hits += 1
+                return self.names[i]
+        radial = np.array([i for i in cand.tolist() if i not in self._polygons], dtype=np.int64)
+        if len(radial):
+            d = haversine_np(lat, lon, self.lat[radial], self.lon[radial])
+            within = d <= self.radius_m[radial]
+            if within.any():
+                # ближайший относительно своего радиуса: точка между деревней и городом — к городу
+                best = radial[within][np.argmin(d[within] / self.radius_m[radial][within])]
+                self.hits += 1
+                return self.names[int(best)]
+        self.misses += 1
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses}
+
+
+gazetteer = Gazetteer()
+stats_collector("gazetteer", "Offline gazetteer", gazetteer.stats)
+
+
+def init_gazetteer() -> None:
+    """Загружает справочник из ``settings.gazetteer_path`` (если задан); ошибка не мешает старту."""
+    if settings.gazetteer_path is None:
+        return
+    try:
+        gazetteer.load(settings.gazetteer_path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error("Gazetteer {} not loaded, falling back to the geocoder only: {}", settings.gazetteer_path, e)
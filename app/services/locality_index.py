@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.config import settings
+from app.utils.metrics import stats_collector
+
+Envelope = Tuple[float, float, float, float]  # min_lat, min_lon, max_lat, max_lon
+
+
+class LocalityIndex:
+    """
+    Сеточный индекс конвертов (``boundedBy``) населённых пунктов, выученных из ответов Yandex.
+
+    Конверт — прямоугольник, а город — нет, поэтому в индекс кладётся конверт, сжатый к
+    центру в ``shrink`` раз: точки у края всё равно уходят на проверку в геокодер.
+    """
+
+    def __init__(
+        self,
+        shrink: float = 0.7,
+        cell_deg: float = 0.25,
+        max_entries: int = 20000,
+        max_span_deg: float = 1.0,
+    ):
+        self.shrink = shrink
+        self.cell_deg = cell_deg
+        self.max_entries = max_entries
+        self.max_span_deg = max_span_deg
+        self._entries: "OrderedDict[Tuple[str, Envelope], Envelope]" = OrderedDict()
+        self._cells: Dict[Tuple[int, int], List[Tuple[str, Envelope]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _cell_range(self, env: Envelope):
+        min_lat, min_lon, max_lat, max_lon = env
+        c = self.cell_deg
+        for ci in range(int(min_lat // c), int(max_lat // c) + 1):
+            for cj in range(int(min_lon // c), int(max_lon // c) + 1):
+                yield ci, cj
+
+    def add(self, name: str, envelope: Sequence[float]) -> None:
+        min_lat, min_lon, max_lat, max_lon = (float(x) for x in envelope)
+        if max_lat < min_lat or max_lon < min_lon:
+            return
+        if max_lat - min_lat > self.max_span_deg or max_lon - min_lon > self.max_span_deg:
+            # Слишком крупный конверт (агломерация, район) — доверять ему нельзя
+            return
+        c_lat, c_lon = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+        h_lat, h_lon = (max_lat - min_lat) * self.shrink / 2, (max_lon - min_lon) * self.shrink / 2
+        inner: Envelope = (c_lat - h_lat, c_lon - h_lon, c_lat + h_lat, c_lon + h_lon)
+        key = (name, inner)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = inner
+        for cell in self._cell_range(inner):
+            self._cells.setdefault(cell, []).append(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Tuple[str, Envelope]) -> None:
+        inner = self._entries.pop(key)
+        for cell in self._cell_range(inner):
+            bucket = self._cells.get(cell)
+            if bucket:
+                bucket.remove(key)
+                if not bucket:
+                    del self._cells[cell]
+
+    def lookup(self, lat: float, lon: float) -> Optional[str]:
+        """Название населённого пункта, чей (сжатый) конверт содержит точку; при пересечении — самый мелкий."""
+        c = self.cell_deg
+        best: Optional[str] = None
+        best_area = float("inf")
+        for name, env in self._cells.get((int(lat // c), int(lon // c)), ()):
+            min_lat, min_lon, max_lat, max_lon = env
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                area = (max_lat - min_lat) * (max_lon - min_lon)
+                if area < best_area:
+                    best, best_area = name, area
+        if best is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return best
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+locality_index = LocalityIndex(
+    shrink=settings.locality_index_shrink,
+    max_entries=settings.locality_index_max_entries,
+)
+stats_collector("locality_index", "Learned locality envelope index", locality_index.stats)
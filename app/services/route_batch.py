@@ -0,0 +1,100 @@
+"""Пакетное построение маршрутов (/route/batch и CLI).
+
+Внутри пакета геокодирование концов выполняется один раз на уникальный адрес
+(вместе с ошибкой — повторять заведомо неудачный адрес незачем). Маршруты строятся
+не более чем по ``concurrency`` одновременно; запросы к геокодеру и ORS при этом
+проходят через общие для процесса планировщик и лимит, так что пакет не вытесняет
+одиночные /route сверх этих бюджетов.
+"""
+
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.api.schemas import PointIn, RouteBatchItem, RouteRequest, RouteResponse
+from app.config import logger, settings
+from app.integration.yandex_geocoder import normalize_address
+from app.services.route_pipeline import build_route
+from app.services.route_processing import ensure_coords
+
+
+class _EndpointMemo:
+    """Разрешение точек A/B с дедупликацией по нормализованному адресу."""
+
+    def __init__(self):
+        self._tasks: Dict[str, "asyncio.Task[Tuple[float, float, str]]"] = {}
+        self.requested = 0
+
+    async def resolve(self, p: PointIn) -> Tuple[float, float, str]:
+        if p.lat is not None and p.lon is not None:
+            return await ensure_coords(p)
+        self.requested += 1
+        key = normalize_address(p.address)
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.create_task(ensure_coords(p))
+        # shield: отмена одного элемента не должна отменять общий для пакета запрос
+        lat, lon, _ = await asyncio.shield(task)
+        return lat, lon, p.address
+
+    @property
+    def unique(self) -> int:
+        return len(self._tasks)
+
+    def cancel(self) -> None:
+        for t in self._tasks.values():
+            if not t.done():
+                t.cancel()
+            elif not t.cancelled():
+                t.exception()  # ошибка уже отдана элементам; не оставляем "never retrieved"
+
+
+async def _build_item(req: RouteRequest, memo: _EndpointMemo) -> RouteResponse:
+    try:
+        return await build_route(req, resolve=memo.resolve)
+    except HTTPException as he:
+        logger.info("/route/batch item HTTPException: {}", he.detail)
+        return RouteResponse(ok=False, type="error", message=str(he.detail))
+    except Exception as e:
+        logger.exception("unexpected error")
+        return RouteResponse(ok=False, type="error", message=f"Неожиданная ошибка: {e}")
+
+
+async def run_batch(requests: List[RouteRequest], concurrency: Optional[int] = None) -> AsyncIterator[RouteBatchItem]:
+    """Строит маршруты пакета и отдаёт результаты по мере готовности (не по порядку ``index``).
+
+    Ошибка одного маршрута становится его ``RouteResponse(ok=False)``; остальные
+    продолжают строиться. При закрытии генератора незавершённая работа отменяется.
+    """
+    limit = max(1, min(concurrency or settings.route_batch_concurrency, settings.route_batch_concurrency))
+    memo = _EndpointMemo()
+    queue: "asyncio.Queue[RouteBatchItem]" = asyncio.Queue()
+    slots = asyncio.Semaphore(limit)
+
+    async def worker(i: int, req: RouteRequest) -> None:
+        async with slots:
+            res = await _build_item(req, memo)
+        await queue.put(RouteBatchItem(index=i, result=res))
+
+    logger.info("Route batch: items={} concurrency={}", len(requests), limit)
+    tasks = [asyncio.create_task(worker(i, r)) for i, r in enumerate(requests)]
+    done = ok = 0
+    try:
+        for _ in range(len(tasks)):
+            item = await queue.get()
+            done += 1
+            ok += item.result.ok
+            yield item
+    finally:
+        for t in tasks:
+            t.cancel()
+        memo.cancel()
+        logger.info(
+            "Route batch finished: items={} done={} ok={} geocode_requests={} unique_addresses={}",
+            len(requests),
+            done,
+            ok,
+            memo.requested,
+            memo.unique,
+        )
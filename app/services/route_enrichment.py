@@ -0,0 +1,363 @@
+"""Планировщик обогащения маршрута.
+
+Начала шагов и точки выборки промежуточных населённых пунктов собираются в один
+дедуплицированный набор задач геокодирования (точки из одной ячейки кеша — одна
+задача), который выполняется одной пачкой, а результаты раздаются обратно шагам.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+from app.config import logger, settings
+from app.integration.geocoder_scheduler import PRIORITY_STEP, PRIORITY_VIA
+from app.integration.yandex_geocoder import geocode_calls, geocode_reverse, reverse_cache_key
+from app.services.gazetteer import gazetteer
+from app.services.locality_index import locality_index
+from app.services.route_steps import RouteStep, ViaPoint
+from app.utils.geo import round6
+from app.utils.route_geometry import RouteGeometry
+from app.utils.tracing import span
+
+
+async def resolve_localities(
+    points: Sequence[Tuple[float, float]],
+    priorities: Optional[Sequence[int]] = None,
+    on_progress: Optional[Callable[[int, List[Optional[str]]], Awaitable[None]]] = None,
+) -> List[Optional[str]]:
+    """Населённый пункт (или область) для каждой точки.
+
+    Сначала спрашиваем локальный справочник и индекс конвертов, в Yandex уходят только
+    точки вне известных населённых пунктов. Все запросы сразу отдаются планировщику в
+    порядке точек; перед самим HTTP-запросом справочник и индекс проверяются ещё раз,
+    так что конверт, выученный из более раннего ответа, закрывает следующие точки того
+    же города. ``on_progress(n, out)`` вызывается, когда готовый префикс растёт (раз на
+    пачку завершившихся запросов): первые ``n`` элементов ``out`` уже окончательные.
+    """
+    out: List[Optional[str]] = [None] * len(points)
+    use_index = settings.locality_index_enabled
+
+    def known(lat: float, lon: float) -> Optional[str]:
+        found = gazetteer.lookup(lat, lon) if len(gazetteer) else None
+        if not found and use_index:
+            found = locality_index.lookup(lat, lon)
+        return found
+
+    async def resolve(j: int) -> int:
+        lat, lon = points[j]
+        found = known(lat, lon)
+        if found:
+            out[j] = found
+            return j
+
+        def pruned() -> bool:
+            nonlocal found
+            found = known(lat, lon)
+            return found is not None
+
+        priority = priorities[j] if priorities is not None else PRIORITY_STEP
+        try:
+            res = await geocode_reverse(lat, lon, kind="locality", priority=priority, skip=pruned)
+        except Exception as e:
+            logger.debug("Reverse geocode failed for ({}, {}): {}", lat, lon, e)
+            return j
+        if found:
+            out[j] = found
+            return j
+        out[j] = res.get("locality") or res.get("province") or None
+        if use_index and res.get("locality") and res.get("envelope"):
+            locality_index.add(res["locality"], res["envelope"])
+        return j
+
+    done = [lat == 0.0 and lon == 0.0 for lat, lon in points]
+    ready = 0
+    with geocode_calls.scope() as calls:
+        tasks = {asyncio.ensure_future(resolve(j)) for j in range(len(points)) if not done[j]}
+        try:
+            while tasks:
+                finished, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for t in finished:
+                    done[t.result()] = True
+                n = ready
+                while n < len(points) and done[n]:
+                    n += 1
+                if n > ready:
+                    ready = n
+                    if on_progress is not None:
+                        await on_progress(ready, out)
+        finally:
+            for t in tasks:
+                t.cancel()
+    if on_progress is not None and ready < len(points):
+        await on_progress(len(points), out)
+    logger.debug(
+        "Resolved localities: points={} geocoder_calls={} gazetteer={} index={}",
+        len(points),
+        calls[0],
+        gazetteer.stats(),
+        locality_index.stats(),
+    )
+    return out
+
+
+class RouteEnrichmentPlanner:
+    """Собирает задачи геокодирования по всему маршруту и раздаёт результаты шагам.
+
+    ``localities`` / ``vias`` позволяют выполнить только одну из фаз (для старых обёрток
+    ``enrich_localities_with_yandex`` и ``annotate_intermediate_localities``).
+    ``on_step`` вызывается для каждого шага, как только все его задачи выполнены
+    (в адаптивном режиме — после завершения бисекции).
+    """
+
+    def __init__(
+        self,
+        steps: List[RouteStep],
+        step_bounds: List[Tuple[int, int]],
+        coords: Union[RouteGeometry, Sequence[Sequence[float]]],
+        *,
+        min_step_m: int = 5000,
+        sample_interval_m: int = 5000,
+        mode: Optional[str] = None,
+        localities: bool = True,
+        vias: bool = True,
+        on_step: Optional[Callable[[RouteStep], Awaitable[None]]] = None,
+    ):
+        self.steps = steps
+        self.step_bounds = step_bounds
+        self.coords = coords
+        self.min_step_m = min_step_m
+        self.sample_interval_m = sample_interval_m
+        self.mode = mode or settings.via_sampling_mode
+        self.localities = localities
+        self.vias = vias
+        self._geom: Optional[RouteGeometry] = coords if isinstance(coords, RouteGeometry) else None
+        # ключ ячейки → (расстояние от начала маршрута, порядковый номер, lat, lon); результаты — по тем же ключам
+        self._jobs: Dict[str, Tuple[float, int, float, float]] = {}
+        self._priority: Dict[str, int] = {}
+        self._results: Dict[str, Optional[str]] = {}
+        self._start_keys: Dict[int, str] = {}
+        # шаг → [(расстояние, lat, lon, ключ)] — кандидаты в промежуточные пункты
+        self._via: Dict[int, List[Tuple[float, float, float, str]]] = {}
+        self._vias_final = True
+        self._adaptive_steps: Set[int] = set()
+        self._done: Set[int] = set()
+        self.on_step = on_step
+        self.lookups = 0
+
+    @property
+    def geom(self) -> RouteGeometry:
+        if self._geom is None:
+            self._geom = RouteGeometry(self.coords)
+        return self._geom
+
+    def add(self, lat: float, lon: float, dist_m: float, priority: int = PRIORITY_VIA) -> str:
+        key = reverse_cache_key(lat, lon, "locality")
+        if key not in self._jobs:
+            self._jobs[key] = (dist_m, len(self._jobs), lat, lon)
+        self._priority[key] = min(priority, self._priority.get(key, priority))
+        return key
+
+    async def run(self) -> None:
+        """Выполняет все ещё не выполненные задачи одной пачкой, по порядку вдоль маршрута."""
+        pending = sorted((job, key) for key, job in self._jobs.items() if key not in self._results)
+        if not pending:
+            return
+        points = [(lat, lon) for (_, _, lat, lon), _ in pending]
+        priorities = [self._priority[key] for _, key in pending]
+        if self.on_step is None:
+            # шаги некому отдавать по мере готовности — всё применит финальный проход
+            names = await resolve_localities(points, priorities)
+            for (_, key), name in zip(pending, names):
+                self._results[key] = name
+            self.lookups += len(pending)
+            return
+
+        # шаг → число ещё не готовых ключей, ключ → ждущие его шаги
+        missing: Dict[int, int] = {}
+        waiting: Dict[str, List[int]] = {}
+        ready: List[int] = []
+        for i in range(len(self.steps)):
+            if i in self._done or (not self._vias_final and i in self._adaptive_steps):
+                continue
+            keys = {k for k in self._step_keys(i) if k not in self._results}
+            if not keys:
+                ready.append(i)
+                continue
+            missing[i] = len(keys)
+            for k in keys:
+                waiting.setdefault(k, []).append(i)
+        await self._emit(ready)
+        stored = 0
+
+        async def progress(n: int, names: List[Optional[str]]) -> None:
+            nonlocal stored
+            ready: List[int] = []
+            for (_, key), name in zip(pending[stored:n], names[stored:n]):
+                self._results[key] = name
+                for i in waiting.pop(key, ()):
+                    missing[i] -= 1
+                    if not missing[i]:
+                        ready.append(i)
+            stored = n
+            await self._emit(ready)
+
+        await resolve_localities(points, priorities, on_progress=progress)
+        self.lookups += len(pending)
+
+    def result(self, key: str) -> Optional[str]:
+        return self._results.get(key)
+
+    def _step_keys(self, i: int) -> Set[str]:
+        keys = {k for *_, k in self._via.get(i, ())}
+        key = self._start_keys.get(i)
+        if key is not None:
+            keys.add(key)
+        return keys
+
+    def _apply(self, i: int) -> None:
+        s = self.steps[i]
+        if self.localities:
+            key = self._start_keys.get(i)
+            s.locality = self.result(key) if key else None
+        if self.vias:
+            vs: List[ViaPoint] = []
+            for _, lat, lon, key in self._via.get(i, ()):
+                name = self.result(key)
+                if name and (not vs or vs[-1].name != name):
+                    vs.append(ViaPoint(name, round6(lat), round6(lon)))
+            if s.locality:
+                vs = [v for v in vs if v.name != s.locality]
+            s.via_localities = vs or None
+
+    async def _emit(self, steps: Iterable[int]) -> None:
+        for i in sorted(steps):
+            if i in self._done:
+                continue
+            self._apply(i)
+            self._done.add(i)
+            if self.on_step is not None:
+                await self.on_step(self.steps[i])
+
+    async def execute(self) -> None:
+        steps, bounds = self.steps, self.step_bounds
+        long_steps = [i for i, s in enumerate(steps) if s.distance_m > self.min_step_m] if self.vias else []
+        fixed_samples: List[List[Tuple[float, float]]] = []
+        if long_steps and len(self.coords) >= 2:
+            with span("via_sampling"):
+                fixed_samples = self.geom.sample_steps(
+                    [bounds[i] for i in long_steps], interval_m=self.sample_interval_m, max_points=10
+                )
+        n_fixed = sum(len(p) for p in fixed_samples)
+        adaptive = self.mode == "adaptive" and n_fixed > 0
+
+        if self.localities:
+            for i, s in enumerate(steps):
+                if s.start_lat == 0.0 and s.start_lon == 0.0:
+                    continue
+                # без геометрии порядок вдоль маршрута задаёт сам номер шага
+                dist = float(self.geom.cum[bounds[i][0]]) if i < len(bounds) and len(self.coords) else float(i)
+                self._start_keys[i] = self.add(s.start_lat, s.start_lon, dist, PRIORITY_STEP)
+
+        # реальные запросы к геокодеру (без попаданий в кеш, справочник и индекс)
+        with geocode_calls.scope() as calls:
+            if adaptive:
+                self._vias_final = False
+                self._adaptive_steps = set(long_steps)
+                await self._adaptive(long_steps)
+                self._vias_final = True
+            elif n_fixed:
+                for i, pts in zip(long_steps, fixed_samples):
+                    d0 = float(self.geom.cum[bounds[i][0]])
+                    lst = self._via.setdefault(i, [])
+                    for k, (lat, lon) in enumerate(pts, start=1):
+                        d = d0 + k * self.sample_interval_m
+                        lst.append((d, lat, lon, self.add(lat, lon, d)))
+            await self.run()
+        await self._emit(range(len(steps)))
+
+        if adaptive:
+            # фиксированный режим на холодном кеше — по запросу на каждую точку выборки и начало шага
+            fixed_equivalent = n_fixed + len(self._start_keys)
+            logger.info(
+                "Via sampling (adaptive): geocoder_calls={} fixed_equivalent={} saved={} lookups={}",
+                calls[0],
+                fixed_equivalent,
+                fixed_equivalent - calls[0],
+                self.lookups,
+            )
+        logger.debug(
+            "Route enrichment plan: steps={} via_points={} unique_lookups={}",
+            len(steps),
+            sum(len(v) for v in self._via.values()),
+            self.lookups,
+        )
+
+    async def _adaptive(self, long_steps: List[int]) -> None:
+        """Грубая выборка по шагу + бисекция только там, где меняется название.
+
+        Концы шага участвуют лишь как ориентиры для бисекции, в результат попадают
+        внутренние точки — как и в фиксированном режиме. Все шаги проходят один уровень
+        бисекции за раз, и каждый уровень уходит одной пачкой вместе с прочими задачами.
+        """
+        geom = self.geom
+        coarse = settings.via_adaptive_coarse_interval_m
+        min_spacing = settings.via_adaptive_min_spacing_m
+        budget = settings.via_adaptive_call_budget
+        used = 0
+        known: Dict[int, List[Tuple[float, float, float, str]]] = {i: [] for i in long_steps}
+
+        def probe(jobs: List[Tuple[int, float]]) -> None:
+            # бюджет расходуют только новые задачи: точки в уже известных ячейках бесплатны
+            nonlocal used
+            if not jobs:
+                return
+            lat, lon = geom.interpolate(np.array([d for _, d in jobs]))
+            for (i, d), la, lo in zip(jobs, np.round(lat, 6).tolist(), np.round(lon, 6).tolist()):
+                is_new = reverse_cache_key(la, lo, "locality") not in self._jobs
+                if is_new and used >= budget:
+                    continue
+                used += is_new
+                known[i].append((d, la, lo, self.add(la, lo, d)))
+
+        initial: List[Tuple[int, float]] = []
+        for i in long_steps:
+            i0, i1 = self.step_bounds[i]
+            d0, d1 = float(geom.cum[i0]), float(geom.cum[i1])
+            n_inner = max(0, int(np.ceil((d1 - d0) / coarse)) - 1)
+            initial.extend((i, d) for d in [d0, *(d0 + k * coarse for k in range(1, n_inner + 1)), d1])
+        probe(initial)
+        await self.run()
+
+        while used < budget:
+            mids: List[Tuple[int, float]] = []
+            for i, pts in known.items():
+                pts.sort()
+                for (da, *_, ka), (db, *_, kb) in zip(pts, pts[1:]):
+                    if self.result(ka) != self.result(kb) and db - da >= 2 * min_spacing:
+                        mids.append((i, (da + db) / 2))
+            if not mids:
+                break
+            probe(mids)
+            await self.run()
+
+        for i in long_steps:
+            i0, i1 = self.step_bounds[i]
+            d0, d1 = float(geom.cum[i0]), float(geom.cum[i1])
+            self._via[i] = [p for p in sorted(known[i]) if d0 < p[0] < d1]
+
+
+async def enrich_route(
+    steps: List[RouteStep],
+    step_bounds: List[Tuple[int, int]],
+    coords: Union[RouteGeometry, Sequence[Sequence[float]]],
+    *,
+    min_step_m: int = 5000,
+    sample_interval_m: int = 5000,
+    on_step: Optional[Callable[[RouteStep], Awaitable[None]]] = None,
+) -> None:
+    """Locality для каждого шага и промежуточные пункты на длинных шагах — одним планом."""
+    planner = RouteEnrichmentPlanner(
+        steps, step_bounds, coords, min_step_m=min_step_m, sample_interval_m=sample_interval_m, on_step=on_step
+    )
+    await planner.execute()
@@ -0,0 +1,238 @@
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from app.api.schemas import OptionsIn, PointIn, RouteRequest, RouteResponse
+from app.config import logger, settings
+from app.integration.openrouteservice import ors_route
+from app.integration.yandex_geocoder import geocode_calls, rev_cache
+from app.services.route_enrichment import enrich_route
+from app.services.route_processing import ensure_coords, ors_extract_steps
+from app.services.route_steps import RouteStep
+from app.services.route_text import build_markdown
+from app.utils.cache import MISSING, TieredCache, TTLCache
+from app.utils.fastjson import dumps
+from app.utils.metrics import Histogram
+from app.utils.polyline import encode_polyline
+from app.utils.tracing import current_trace, span
+
+RouteEventSink = Callable[[Dict[str, Any]], Awaitable[None]]
+PointResolver = Callable[[PointIn], Awaitable[Tuple[float, float, str]]]
+
+
+# Версия формата отрисовки: входит в ключ кеша, чтобы смена шаблона не отдавала старое
+_RENDER_VERSION = 1
+
+route_geocode_calls = Histogram(
+    "route_geocode_calls",
+    "Geocoder HTTP calls made while building one route",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+route_steps = Histogram("route_steps", "Steps per built route", buckets=(5, 10, 25, 50, 100, 200, 500, 1000))
+route_distance = Histogram(
+    "route_distance_meters",
+    "Length of built routes",
+    buckets=(1e3, 5e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2e6, 5e6),
+)
+
+render_cache = TieredCache(
+    "route_render",
+    memory=TTLCache(max_bytes=settings.route_render_cache_bytes, ttl_s=settings.route_render_cache_ttl_s),
+    dumps=bytes,
+    loads=bytes,
+)
+
+
+@dataclass
+class RouteData:
+    """Маршрут после ORS и обогащения — всё, от чего зависит отрисованный ответ."""
+
+    a: Tuple[str, float, float]
+    b: Tuple[str, float, float]
+    waypoints: List[Tuple[str, float, float]]
+    steps: List[RouteStep]
+    total_m: float
+    total_s: float
+    geometry: Optional[str]
+    _key: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        """Хеш содержимого; он же ETag ответа."""
+        if self._key is None:
+            payload = [
+                _RENDER_VERSION,
+                self.a,
+                self.b,
+                self.waypoints,
+                self.total_m,
+                self.total_s,
+                [s.to_dict() for s in self.steps],
+                self.geometry,
+            ]
+            self._key = hashlib.blake2b(dumps(payload), digest_size=16).hexdigest()
+        return self._key
+
+    def markdown(self) -> str:
+        with span("render"):
+            return self._markdown()
+
+    def _markdown(self) -> str:
+        cached = render_cache.get("md:" + self.key)
+        if cached is not MISSING:
+            return cached.decode("utf-8")
+        (a_label, a_lat, a_lon), (b_label, b_lat, b_lon) = self.a, self.b
+        md = build_markdown(
+            a_label,
+            a_lat,
+            a_lon,
+            b_label,
+            b_lat,
+            b_lon,
+            self.steps,
+            self.total_m,
+            self.total_s,
+            waypoints=self.waypoints,
+        )
+        render_cache.set("md:" + self.key, md.encode("utf-8"))
+        return md
+
+    def response(self, md: str) -> RouteResponse:
+        # В схему ответа шаги переходят один раз — одним проходом валидации по словарям
+        return RouteResponse(ok=True, markdown=md, steps=[s.to_dict() for s in self.steps], geometry=self.geometry)
+
+
+@dataclass
+class RenderedRoute:
+    body: bytes  # RouteResponse в JSON
+    etag: Optional[str] = None  # только для успешных ответов
+
+
+async def compute_route(
+    req: RouteRequest,
+    on_event: Optional[RouteEventSink] = None,
+    resolve: PointResolver = ensure_coords,
+) -> Union[RouteData, RouteResponse]:
+    """Геокодирование остановок → ORS → обогащение шагов; без отрисовки.
+
+    Если передан ``on_event``, по ходу работы он получает события для потоковой выдачи:
+    ``summary`` (сразу после ORS, шаги ещё без населённых пунктов) и ``step`` (шаг
+    обогащён). Ошибки upstream пробрасываются как ``HTTPException``; пустой маршрут
+    возвращается готовым ``RouteResponse`` с ошибкой.
+    ``resolve`` переводит точку A/B в координаты (пакетный режим подставляет общий memo).
+    """
+    with geocode_calls.scope() as calls:
+        data = await _compute_route(req, on_event, resolve)
+    route_geocode_calls.observe(calls[0])
+    if isinstance(data, RouteData):
+        route_steps.observe(len(data.steps))
+        route_distance.observe(data.total_m)
+    return data
+
+
+async def _compute_route(
+    req: RouteRequest, on_event: Optional[RouteEventSink], resolve: PointResolver
+) -> Union[RouteData, RouteResponse]:
+    # Все остановки разрешаются параллельно; маршрут через них — один запрос к ORS
+    points = await asyncio.gather(resolve(req.a), *(resolve(p) for p in req.waypoints or ()), resolve(req.b))
+    (a_lat, a_lon, a_label), *stops, (b_lat, b_lon, b_label) = points
+    waypoints = [(label, lat, lon) for lat, lon, label in stops]
+    logger.debug("Resolved coords: A=({},{}) via={} B=({},{})", a_lat, a_lon, len(waypoints), b_lat, b_lon)
+
+    opts = req.options or OptionsIn(language="ru", avoid_tolls=False)
+    with span("ors"):
+        data = await ors_route(a_lat, a_lon, b_lat, b_lon, opts, via=[(lat, lon) for _, lat, lon in waypoints])
+    steps, total_m, total_s, geom, step_bounds = ors_extract_steps(data)
+    del data  # геометрия уже в компактных массивах — разобранный GeoJSON больше не нужен
+    logger.debug("ORS returned: steps={} total_m={} total_s={}", len(steps), total_m, total_s)
+
+    if not steps:
+        logger.info("/route: empty steps")
+        return RouteResponse(ok=False, type="error", message="Маршрут пуст (нет шагов)")
+
+    geometry = None
+    if opts.include_geometry:
+        tol = settings.route_geometry_tolerance_m if opts.geometry_tolerance_m is None else opts.geometry_tolerance_m
+        with span("geometry"):
+            keep = geom.simplify(tol, [b[0] for b in step_bounds])
+            geometry = encode_polyline(geom.lat[keep], geom.lon[keep])
+        logger.debug("Route geometry: {} of {} points, {} chars", len(keep), len(geom), len(geometry))
+
+    on_step = None
+    if on_event is not None:
+        await on_event(
+            {
+                "type": "summary",
+                "a": {"label": a_label, "lat": a_lat, "lon": a_lon},
+                "b": {"label": b_label, "lat": b_lat, "lon": b_lon},
+                "waypoints": [{"label": label, "lat": lat, "lon": lon} for label, lat, lon in waypoints],
+                "total_m": total_m,
+                "total_s": total_s,
+                "steps": [s.to_dict() for s in steps],
+                "geometry": geometry,
+            }
+        )
+
+        async def on_step(s: RouteStep) -> None:
+            await on_event(
+                {
+                    "type": "step",
+                    "idx": s.idx,
+                    "locality": s.locality,
+                    "via_localities": [v.to_dict() for v in s.via_localities] if s.via_localities else None,
+                }
+            )
+
+    # Обогащаем locality и добавляем промежуточные населённые пункты на длинных шагах — одним планом
+    with span("enrich"):
+        await enrich_route(steps, step_bounds, geom, min_step_m=5000, sample_interval_m=5000, on_step=on_step)
+
+    logger.opt(lazy=True).debug("Reverse geocode cache: {}", rev_cache.stats)
+    return RouteData((a_label, a_lat, a_lon), (b_label, b_lat, b_lon), waypoints, steps, total_m, total_s, geometry)
+
+
+async def build_route(
+    req: RouteRequest,
+    on_event: Optional[RouteEventSink] = None,
+    resolve: PointResolver = ensure_coords,
+) -> RouteResponse:
+    """Полный конвейер /route: :func:`compute_route` → markdown (событие ``markdown`` в ``on_event``)."""
+    data = await compute_route(req, on_event, resolve)
+    if isinstance(data, RouteResponse):
+        return data
+    md = data.markdown()
+    if on_event is not None:
+        await on_event({"type": "markdown", "markdown": md})
+    logger.info("/route success: steps={}", len(data.steps))
+    return data.response(md)
+
+
+async def build_route_rendered(req: RouteRequest, debug: bool = False) -> RenderedRoute:
+    """Готовое тело ответа /route с ETag; одинаковый маршрут отрисовывается и сериализуется один раз.
+
+    При ``debug`` ответ несёт разбивку времени текущей трассы в ``timing`` и поэтому
+    собирается заново, мимо кеша и без ETag.
+    """
+    data = await compute_route(req)
+    trace = current_trace() if debug else None
+    if isinstance(data, RouteResponse):
+        if trace is not None:
+            data.timing = trace.breakdown()
+        return RenderedRoute(data.model_dump_json().encode("utf-8"))
+    if trace is not None:
+        res = data.response(data.markdown())
+        res.timing = trace.breakdown()
+        logger.info("/route success (debug): steps={}", len(data.steps))
+        return RenderedRoute(res.model_dump_json().encode("utf-8"))
+    key = "json:" + data.key
+    body = render_cache.get(key)
+    if body is MISSING:
+        res = data.response(data.markdown())
+        with span("serialize"):
+            body = res.model_dump_json().encode("utf-8")
+        render_cache.set(key, body)
+    else:
+        logger.debug("Rendered route cache hit: {}", data.key)
+    logger.info("/route success: steps={}", len(data.steps))
+    return RenderedRoute(body, etag=f'"{data.key}"')
@@ -1,18 +1,25 @@
-import asyncio
-from typing import Dict, List, Optional, Tuple
+from typing import List, Optional, Sequence, Tuple, Union
 
 from fastapi import HTTPException
 
-from app.api.schemas import OptionsIn, PointIn, StepOut, ViaLocality
-from app.integration.openrouteservice import ors_route
-from app.integration.yandex_geocoder import geocode_forward, geocode_reverse
-from app.utils.geo import round6, sample_points_along
+from app.api.schemas import PointIn
+from app.integration.yandex_geocoder import geocode_forward
+from app.services.route_enrichment import RouteEnrichmentPlanner
+from app.services.route_steps import RouteStep
+from app.utils.geo import round6
+from app.utils.route_geometry import RouteGeometry
+from app.utils.tracing import span
 from app.config import logger
 
 
 def ors_extract_steps(
     data: dict,
-) -> Tuple[List[StepOut], float, float, List[List[float]], List[Tuple[int, int]]]:
+) -> Tuple[List[RouteStep], float, float, RouteGeometry, List[Tuple[int, int]]]:
+    with span("extract"):
+        return _extract_steps(data)
+
+
+def _extract_steps(data: dict) -> Tuple[List[RouteStep], float, float, RouteGeometry, List[Tuple[int, int]]]:
     logger.debug("Extracting steps from ORS response")
     features = data.get("features") or []
     if not features:
@@ -24,19 +31,21 @@ def ors_extract_steps(
     total_m = float(summary.get("distance", 0.0))
     total_s = float(summary.get("duration", 0.0))
 
-    coords = (feat.get("geometry") or {}).get("coordinates") or []
+    # Геометрия сразу переводится в массивы: после разбора ``data`` можно не держать
+    geom = RouteGeometry((feat.get("geometry") or {}).get("coordinates") or [])
 
-    out: List[StepOut] = []
+    out: List[RouteStep] = []
     bounds: List[Tuple[int, int]] = []
     idx = 0
-    for seg in props.get("segments", []) or []:
+    for leg, seg in enumerate(props.get("segments", []) or []):
         for st in seg.get("steps", []) or []:
             wp = st.get("way_points", [0, 0])
             i0, i1 = int(wp[0]), int(wp[1])
-            lon, lat = coords[i0]
+            lat, lon = geom.lat[i0], geom.lon[i0]
             out.append(
-                StepOut(
+                RouteStep(
                     idx=idx,
+                    leg=leg,
                     start_lat=round6(float(lat)),
                     start_lon=round6(float(lon)),
                     distance_m=int(round(float(st.get("distance", 0)))),
@@ -49,79 +58,43 @@ def ors_extract_steps(
             bounds.append((i0, i1))
             idx += 1
 
-    logger.debug("Extracted steps=%d total_m=%s total_s=%s", len(out), total_m, total_s)
-    return out, total_m, total_s, coords, bounds
+    logger.debug("Extracted steps={} total_m={} total_s={}", len(out), total_m, total_s)
+    return out, total_m, total_s, geom, bounds
 
 
 async def annotate_intermediate_localities(
-    steps: List[StepOut],
+    steps: List[RouteStep],
     step_bounds: List[Tuple[int, int]],
-    coords: List[List[float]],
+    coords: Union[RouteGeometry, Sequence[Sequence[float]]],
     *,
     min_step_m: int = 5000,
     sample_interval_m: int = 5000,
+    mode: Optional[str] = None,
 ) -> None:
     logger.debug("Annotating intermediate localities")
-    sample_tasks = []
-    sample_meta: List[Tuple[int, float, float]] = []
-
-    for i, s in enumerate(steps):
-        if s.distance_m <= min_step_m:
-            continue
-        i0, i1 = step_bounds[i]
-        sub = coords[i0 : i1 + 1]
-        pts = sample_points_along(sub, interval_m=sample_interval_m, max_points=10)
-        for lat, lon in pts:
-            sample_meta.append((i, lat, lon))
-            sample_tasks.append(geocode_reverse(lat, lon, kind="locality"))
-
-    if not sample_tasks:
-        logger.debug("No long steps to annotate")
-        return
-
-    results = await asyncio.gather(*sample_tasks, return_exceptions=True)
-
-    by_step: Dict[int, List[ViaLocality]] = {}
-    for (i, lat, lon), res in zip(sample_meta, results):
-        if isinstance(res, Exception) or not isinstance(res, dict):
-            continue
-        name = res.get("locality") or res.get("province")
-        if not name:
-            continue
-        if i not in by_step:
-            by_step[i] = []
-        if not by_step[i] or by_step[i][-1].name != name:
-            by_step[i].append(ViaLocality(name=name, lat=round6(lat), lon=round6(lon)))
-
-    for i, s in enumerate(steps):
-        vias = by_step.get(i, [])
-        if s.locality:
-            vias = [v for v in vias if v.name != s.locality]
-        s.via_localities = vias or None
+    planner = RouteEnrichmentPlanner(
+        steps,
+        step_bounds,
+        coords,
+        min_step_m=min_step_m,
+        sample_interval_m=sample_interval_m,
+        mode=mode,
+        localities=False,
+    )
+    await planner.execute()
     logger.debug("Annotated intermediate localities where applicable")
 
 
-async def enrich_localities_with_yandex(steps: List[StepOut]) -> None:
+async def enrich_localities_with_yandex(steps: List[RouteStep]) -> None:
     logger.debug("Enriching steps with locality via Yandex reverse geocode")
-    tasks = []
-    for s in steps:
-        lat, lon = s.start_lat, s.start_lon
-        if lat == 0.0 and lon == 0.0:
-            tasks.append(asyncio.sleep(0, result={}))
-        else:
-            tasks.append(geocode_reverse(lat, lon, kind="locality"))
-
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    for s, res in zip(steps, results):
-        if isinstance(res, Exception) or not isinstance(res, dict):
-            continue
-        s.locality = res.get("locality") or res.get("province") or None
+    await RouteEnrichmentPlanner(steps, [], [], vias=False).execute()
     logger.debug("Enriched steps with locality")
 
 
 async def ensure_coords(p: PointIn) -> Tuple[float, float, str]:
-    logger.debug("Ensuring coords for point: %s", p)
+    logger.debug("Ensuring coords for point: {}", p)
     if p.lat is not None and p.lon is not None:
         return float(p.lat), float(p.lon), f"{p.lat:.6f}, {p.lon:.6f}"
-    lat, lon = await geocode_forward(p.address)
+    with span("geocode"):
+        lat, lon = await geocode_forward(p.address)
     return lat, lon, p.address
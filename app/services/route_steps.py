@@ -0,0 +1,50 @@
+"""Внутреннее представление шагов маршрута.
+
+Конвейер /route создаёт и многократно правит шаги (locality, промежуточные пункты),
+поэтому внутри используются лёгкие dataclass-записи со ``__slots__``: без
+создания pydantic-модели на каждый шаг и пункт. В схему ответа (``StepOut``) шаги
+переводятся один раз, на выходе: словари из ``to_dict`` валидируются одним вызовом
+pydantic-core. Это быстрее ``model_construct``, который разбирает поля на Python.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+
+@dataclass(slots=True)
+class ViaPoint:
+    name: str
+    lat: float
+    lon: float
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "lat": self.lat, "lon": self.lon}
+
+
+@dataclass(slots=True)
+class RouteStep:
+    idx: int
+    leg: int
+    start_lat: float
+    start_lon: float
+    distance_m: int
+    duration_s: int
+    instruction: Optional[str] = None
+    street: Optional[str] = None
+    locality: Optional[str] = None
+    via_localities: Optional[List[ViaPoint]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Тот же словарь, что ``StepOut.model_dump()``."""
+        return {
+            "idx": self.idx,
+            "leg": self.leg,
+            "start_lat": self.start_lat,
+            "start_lon": self.start_lon,
+            "distance_m": self.distance_m,
+            "duration_s": self.duration_s,
+            "instruction": self.instruction,
+            "street": self.street,
+            "locality": self.locality,
+            "via_localities": [v.to_dict() for v in self.via_localities] if self.via_localities else None,
+        }
@@ -1,6 +1,6 @@
-from typing import List
+from typing import List, Optional, Tuple
 
-from app.api.schemas import StepOut
+from app.services.route_steps import RouteStep
 from app.config import logger
 
 
@@ -23,35 +23,9 @@ def fmt_duration_s(s: float) -> str:
     return f"{s} с"
 
 
-def build_markdown(
-    a_label: str,
-    a_lat: float,
-    a_lon: float,
-    b_label: str,
-    b_lat: float,
-    b_lon: float,
-    steps: List[StepOut],
-    total_m: float,
-    total_s: float,
-) -> str:
-    logger.debug(
-        "Building markdown: A=(%s,%s '%s') B=(%s,%s '%s') steps=%d",
-        a_lat,
-        a_lon,
-        a_label,
-        b_lat,
-        b_lon,
-        b_label,
-        len(steps),
-    )
-    md = []
-    md.append("# Маршрут A → B\n")
-    md.append(f"**A:** {a_label} ({a_lat:.6f}, {a_lon:.6f})  \n**B:** {b_label} ({b_lat:.6f}, {b_lon:.6f})\n")
-    md.append(f"**Итого:** {fmt_distance_m(total_m)} • {fmt_duration_s(total_s)}\n")
-
-    md.append("## По населённым пунктам\n")
+def _locality_sections(md: List[str], steps: List[RouteStep]) -> None:
     cur_loc = None
-    buf: List[StepOut] = []
+    buf: List[RouteStep] = []
 
     def flush():
         nonlocal buf
@@ -79,6 +53,57 @@ def build_markdown(
         buf.append(s)
     flush()
 
+
+def build_markdown(
+    a_label: str,
+    a_lat: float,
+    a_lon: float,
+    b_label: str,
+    b_lat: float,
+    b_lon: float,
+    steps: List[RouteStep],
+    total_m: float,
+    total_s: float,
+    waypoints: Optional[List[Tuple[str, float, float]]] = None,
+) -> str:
+    """Markdown-путеводитель; при ``waypoints`` (label, lat, lon) шаги группируются по участкам."""
+    logger.debug(
+        "Building markdown: A=({},{} '{}') B=({},{} '{}') waypoints={} steps={}",
+        a_lat,
+        a_lon,
+        a_label,
+        b_lat,
+        b_lon,
+        b_label,
+        len(waypoints or []),
+        len(steps),
+    )
+    md = []
+    md.append("# Маршрут A → B\n")
+    if waypoints:
+        stops = "".join(
+            f"**{n}:** {label} ({lat:.6f}, {lon:.6f})  \n" for n, (label, lat, lon) in enumerate(waypoints, 1)
+        )
+        md.append(
+            f"**A:** {a_label} ({a_lat:.6f}, {a_lon:.6f})  \n{stops}**B:** {b_label} ({b_lat:.6f}, {b_lon:.6f})\n"
+        )
+    else:
+        md.append(f"**A:** {a_label} ({a_lat:.6f}, {a_lon:.6f})  \n**B:** {b_label} ({b_lat:.6f}, {b_lon:.6f})\n")
+    md.append(f"**Итого:** {fmt_distance_m(total_m)} • {fmt_duration_s(total_s)}\n")
+
+    if not waypoints:
+        md.append("## По населённым пунктам\n")
+        _locality_sections(md, steps)
+    else:
+        names = ["A", *(str(n) for n in range(1, len(waypoints) + 1)), "B"]
+        for leg in range(len(names) - 1):
+            leg_steps = [s for s in steps if s.leg == leg]
+            leg_m = sum(s.distance_m for s in leg_steps)
+            leg_s = sum(s.duration_s for s in leg_steps)
+            md.append(f"## Участок {names[leg]} → {names[leg + 1]}\n")
+            md.append(f"{fmt_distance_m(leg_m)} • {fmt_duration_s(leg_s)}\n")
+            _locality_sections(md, leg_steps)
+
     md.append("## Ключевые точки\n")
     for s in steps:
         md.append(f"- Шаг {s.idx+1}: ({s.start_lat:.6f}, {s.start_lon:.6f}) — {s.street or 'улица не определена'}")
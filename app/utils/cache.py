@@ -0,0 +1,406 @@
+"""Двухуровневый кеш: LRU с TTL в памяти процесса + SQLite на диске.
+
+Значения хранятся в сериализованном виде (``bytes``) в обоих уровнях, поэтому
+вызывающий код всегда получает свежую копию и не может испортить кеш мутацией.
+Асинхронный код читает через ``aget``: обращение к диску уходит в поток, а запись
+и вытеснение и так выполняет фоновый поток ``SqliteCache``.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from app.config import logger
+from app.utils.fastjson import dumps as json_dumps, loads as json_loads
+from app.utils.metrics import Family, registry
+
+MISSING: Any = object()
+
+
+class TTLCache:
+    """LRU-кеш в памяти с TTL и ограничением по числу записей и/или байтам."""
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None, ttl_s: float = 3600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._data: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            raw, expires_at = item
+            if expires_at <= time.time():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return raw
+
+    def set(self, key: str, raw: bytes, ttl_s: Optional[float] = None, expires_at: Optional[float] = None) -> None:
+        if expires_at is None:
+            expires_at = time.time() + (self.ttl_s if ttl_s is None else ttl_s)
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            if self.max_bytes is not None and len(raw) > self.max_bytes:
+                return
+            self._data[key] = (raw, expires_at)
+            self._bytes += len(raw)
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _pop(self, key: str) -> None:
+        raw, _ = self._data.pop(key)
+        self._bytes -= len(raw)
+
+    def _evict(self) -> None:
+        while self._data and (
+            (self.max_entries is not None and len(self._data) > self.max_entries)
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            oldest = next(iter(self._data))
+            self._pop(oldest)
+
+
+class SqliteCache:
+    """Персистентный KV-кеш на SQLite (WAL) с TTL и вытеснением давно не читанных записей.
+
+    Записи и отметки времени чтения не пишутся в БД сразу: они копятся в очереди, и
+    фоновый поток сбрасывает её одной транзакцией раз в ``flush_interval_s`` или по
+    набору ``batch_size`` изменений. ``get`` видит и ещё не сброшенные записи.
+    Ограничения по размеру проверяются не на каждой записи, а раз в ``evict_every``
+    вставок, поэтому таблица может ненадолго превысить лимит на эту величину.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        table: str,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        evict_every: int = 100,
+        flush_interval_s: float = 0.5,
+        batch_size: int = 512,
+    ):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evict_every = max(1, evict_every)
+        self.flush_interval_s = flush_interval_s
+        self.batch_size = max(1, batch_size)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()  # соединение с БД
+        self._writes = 0
+        self._evicted = False
+        # очередь: ключ → (значение, срок) и ключ → время последнего чтения
+        self._pending: Dict[str, Tuple[bytes, float]] = {}
+        self._touched: Dict[str, float] = {}
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Condition(threading.Lock())
+        self._writer: Optional[threading.Thread] = None
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table}(accessed_at)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_expires ON {self.table}(expires_at)")
+            self._init_totals(conn)
+            self._conn = conn
+        return self._conn
+
+    def _init_totals(self, conn: sqlite3.Connection) -> None:
+        """Число записей и суммарный размер ведут триггеры в служебной таблице —
+        вытеснению не нужно сканировать таблицу со значениями."""
+        t = self.table
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {t}_totals ("
+            "id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER NOT NULL, bytes INTEGER NOT NULL)"
+        )
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute(f"SELECT 1 FROM {t}_totals").fetchone() is None:
+                # таблица из старой версии без счётчиков: посчитать один раз
+                conn.execute(f"INSERT INTO {t}_totals SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM {t}")
+            conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {t}_ins AFTER INSERT ON {t} BEGIN "
+                f"UPDATE {t}_totals SET entries = entries + 1, bytes = bytes + NEW.size; END"
+            )
+            conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {t}_del AFTER DELETE ON {t} BEGIN "
+                f"UPDATE {t}_totals SET entries = entries - 1, bytes = bytes - OLD.size; END"
+            )
+            conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {t}_upd AFTER UPDATE OF size ON {t} BEGIN "
+                f"UPDATE {t}_totals SET bytes = bytes + NEW.size - OLD.size; END"
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+    def totals(self) -> Tuple[int, int]:
+        """(число записей, байт) в таблице — без сброса очереди."""
+        with self._lock:
+            return self._totals(self._connect())
+
+    def _totals(self, conn: sqlite3.Connection) -> Tuple[int, int]:
+        entries, size = conn.execute(f"SELECT entries, bytes FROM {self.table}_totals").fetchone()
+        return entries, size
+
+    def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        now = time.time()
+        with self._pending_lock:
+            pending = self._pending.get(key)
+        if pending is not None:
+            raw, expires_at = pending
+            return (raw, expires_at) if expires_at > now else None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at <= now:
+            # просроченное удалит очередной проход вытеснения
+            return None
+        self._enqueue(touched=(key, now))
+        return bytes(value), expires_at
+
+    def set(self, key: str, raw: bytes, expires_at: float) -> None:
+        self._enqueue(write=(key, raw, expires_at))
+
+    def _enqueue(
+        self, write: Optional[Tuple[str, bytes, float]] = None, touched: Optional[Tuple[str, float]] = None
+    ) -> None:
+        with self._pending_lock:
+            if write is not None:
+                key, raw, expires_at = write
+                self._pending[key] = (raw, expires_at)
+            if touched is not None:
+                self._touched[touched[0]] = touched[1]
+            full = len(self._pending) + len(self._touched) >= self.batch_size
+            if self._writer is None and not self._closed:
+                self._writer = threading.Thread(target=self._run_writer, name=f"cache-{self.table}", daemon=True)
+                self._writer.start()
+        if full:
+            with self._wakeup:
+                self._wakeup.notify()
+
+    def flush(self) -> int:
+        """Сбрасывает очередь в БД одной транзакцией; возвращает число изменений."""
+        with self._pending_lock:
+            writes, self._pending = self._pending, {}
+            touched, self._touched = self._touched, {}
+        if not writes and not touched:
+            return 0
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            writes_after = self._writes + len(writes)
+            # первый сброс тоже чистит таблицу (просроченное с прошлого запуска)
+            evict = not self._evicted or writes_after // self.evict_every != self._writes // self.evict_every
+            try:
+                conn.execute("BEGIN")
+                # UPSERT, а не INSERT OR REPLACE: замена строки через REPLACE не вызывает триггер удаления
+                conn.executemany(
+                    f"INSERT INTO {self.table} (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                    "expires_at = excluded.expires_at, accessed_at = excluded.accessed_at",
+                    [(key, raw, len(raw), expires_at, now) for key, (raw, expires_at) in writes.items()],
+                )
+                conn.executemany(
+                    f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?",
+                    [(at, key) for key, at in touched.items() if key not in writes],
+                )
+                if evict:
+                    self._evict(conn)
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                # вернуть пачку в очередь (более свежие записи из очереди важнее)
+                with self._pending_lock:
+                    self._pending = {**writes, **self._pending}
+                    self._touched = {**touched, **self._touched}
+                raise
+            self._writes = writes_after
+            self._evicted = self._evicted or evict
+        return len(writes) + len(touched)
+
+    def _run_writer(self) -> None:
+        while True:
+            with self._wakeup:
+                if not self._closed:
+                    self._wakeup.wait(self.flush_interval_s)
+                closed = self._closed
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.warning("Cache table {}: flush failed: {}", self.table, e)
+            if closed:
+                return
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Вызывается из ``flush`` внутри его транзакции; работа пропорциональна числу жертв, а не размеру таблицы."""
+        conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+        entries, size = self._totals(conn)
+        if self.max_entries is not None and entries > self.max_entries:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)",
+                (entries - self.max_entries,),
+            )
+            entries, size = self._totals(conn)
+        if self.max_bytes is not None and size > self.max_bytes:
+            excess = size - self.max_bytes
+            victims = []
+            for key, vsize in conn.execute(f"SELECT key, size FROM {self.table} ORDER BY accessed_at"):
+                if excess <= 0:
+                    break
+                victims.append((key,))
+                excess -= vsize
+            conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", victims)
+
+    def close(self) -> None:
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify()
+        with self._pending_lock:
+            writer = self._writer
+        if writer is not None:
+            writer.join()
+        else:
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.warning("Cache table {}: flush failed: {}", self.table, e)
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class TieredCache:
+    """Память → диск. Промах в памяти, найденный на диске, поднимается в память."""
+
+    def __init__(
+        self,
+        name: str,
+        memory: TTLCache,
+        disk: Optional[SqliteCache] = None,
+        dumps: Callable[[Any], bytes] = json_dumps,
+        loads: Callable[[bytes], Any] = json_loads,
+    ):
+        self.name = name
+        self.memory = memory
+        self.disk = disk
+        self.dumps = dumps
+        self.loads = loads
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        _tiered_caches.add(self)
+
+    def get(self, key: str) -> Any:
+        raw = self.memory.get(key)
+        if raw is not None:
+            self.hits_memory += 1
+            return self.loads(raw)
+        if self.disk is None:
+            self.misses += 1
+            return MISSING
+        return self._from_disk(key, self._disk_get(key))
+
+    async def aget(self, key: str) -> Any:
+        """Как ``get``, но чтение с диска не блокирует event loop."""
+        raw = self.memory.get(key)
+        if raw is not None:
+            self.hits_memory += 1
+            return self.loads(raw)
+        if self.disk is None:
+            self.misses += 1
+            return MISSING
+        return self._from_disk(key, await asyncio.to_thread(self._disk_get, key))
+
+    def _disk_get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        try:
+            return self.disk.get(key)
+        except sqlite3.Error as e:
+            logger.warning("Cache {}: disk read failed: {}", self.name, e)
+            return None
+
+    def _from_disk(self, key: str, found: Optional[Tuple[bytes, float]]) -> Any:
+        if found is None:
+            self.misses += 1
+            return MISSING
+        raw, expires_at = found
+        self.memory.set(key, raw, expires_at=expires_at)
+        self.hits_disk += 1
+        return self.loads(raw)
+
+    def set(self, key: str, value: Any, ttl_s: Optional[float] = None) -> None:
+        raw = self.dumps(value)
+        expires_at = time.time() + (self.memory.ttl_s if ttl_s is None else ttl_s)
+        self.memory.set(key, raw, expires_at=expires_at)
+        if self.disk is not None:
+            # только ставит в очередь; ошибки записи логирует поток SqliteCache
+            self.disk.set(key, raw, expires_at)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.size_bytes,
+        }
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
+
+
+_tiered_caches: "weakref.WeakSet[TieredCache]" = weakref.WeakSet()
+
+
+@registry.collector
+def _cache_metrics() -> Iterable[Family]:
+    caches = sorted(_tiered_caches, key=lambda c: c.name)
+    hits = [({"cache": c.name, "tier": "memory"}, c.hits_memory) for c in caches]
+    hits += [({"cache": c.name, "tier": "disk"}, c.hits_disk) for c in caches]
+    yield "cache_hits_total", "counter", "Cache hits by tier", hits
+    yield "cache_misses_total", "counter", "Cache misses", [({"cache": c.name}, c.misses) for c in caches]
+    entries = [({"cache": c.name}, len(c.memory)) for c in caches]
+    yield "cache_memory_entries", "gauge", "Entries in the in-memory tier", entries
+    size = [({"cache": c.name}, c.memory.size_bytes) for c in caches]
+    yield "cache_memory_bytes", "gauge", "Bytes in the in-memory tier", size
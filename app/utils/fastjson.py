@@ -0,0 +1,51 @@
+"""Единая точка JSON-(де)сериализации: orjson, если установлен, иначе stdlib.
+
+Формат совпадает в обоих режимах: UTF-8 без экранирования не-ASCII, компактные
+разделители. ``settings.fast_json=False`` принудительно включает stdlib.
+"""
+
+import json
+from typing import Any, Union
+
+from fastapi.responses import JSONResponse
+
+from app.config import settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+# orjson.JSONDecodeError наследует json.JSONDecodeError — ловить можно одинаково
+JSONDecodeError = json.JSONDecodeError
+
+if orjson is not None and settings.fast_json:
+    BACKEND = "orjson"
+    # numpy-скаляры/массивы из геометрии и нестроковые ключи — как в stdlib
+    _OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(value, option=_OPTIONS)
+
+    def loads(raw: Union[bytes, str]) -> Any:
+        return orjson.loads(raw)
+
+else:
+    BACKEND = "json"
+
+    def dumps(value: Any) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def loads(raw: Union[bytes, str]) -> Any:
+        return json.loads(raw)
+
+
+def dumps_str(value: Any) -> str:
+    return dumps(value).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """``JSONResponse`` на выбранном бэкенде (класс ответа API по умолчанию)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,9 +1,11 @@
 import httpx
 
+from app.utils.fastjson import loads
+
 
 def safe_http_error_message(r: httpx.Response) -> str:
     try:
-        j = r.json()
+        j = loads(r.content)
         return j.get("message") or str(j)[:300]
     except Exception:
         return r.text[:300]
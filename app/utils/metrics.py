@@ -0,0 +1,195 @@
+"""Метрики процесса в текстовом формате Prometheus.
+
+Без внешних зависимостей и дешёвые на горячем пути: наблюдение — это поиск корзины
+``bisect`` и пара сложений под блокировкой. Метрики регистрируются при создании в
+общем ``registry``; состояние, которое уже хранится в других объектах (статистика
+кешей, планировщика геокодера и т.п.), отдаётся через ``registry.collector``.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+# (имя, тип, описание, [(метки, значение)])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List["_Metric"] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric") -> None:
+        with self._lock:
+            self._metrics.append(metric)
+
+    def collector(self, fn: Callable[[], Iterable[Family]]) -> Callable[[], Iterable[Family]]:
+        """Регистрирует функцию, отдающую метрики на момент запроса (можно как декоратор)."""
+        with self._lock:
+            self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        out: List[str] = []
+        for metric in list(self._metrics):
+            out.extend(metric.render())
+        for fn in list(self._collectors):
+            for name, kind, help_text, samples in fn():
+                out.append(f"# HELP {name} {help_text}")
+                out.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    out.append(f"{name}{_labels(list(labels), list(labels.values()))} {_num(value)}")
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки → (счётчики по корзинам (последняя — +Inf), сумма)
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][i] += 1
+            series[1][0] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """Наблюдает длительность блока в секундах (и при исключении тоже)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(c), s[0])) for k, (c, s) in self._series.items())
+        out = self._header()
+        for labels, (counts, total) in items:
+            acc = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                acc += n
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, labels, ('le', _num(bound)))} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_num(total)}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, labels)} {acc}")
+        return out
+
+
+def stats_collector(
+    prefix: str, what: str, stats: Callable[[], Dict[str, float]], gauges: Sequence[str] = ("entries",)
+) -> None:
+    """Отдаёт словарь ``stats()`` как метрики ``{prefix}_{key}``: ключи из ``gauges`` — gauge, прочие — counter."""
+
+    def collect() -> Iterable[Family]:
+        for key, value in stats().items():
+            if key in gauges:
+                yield f"{prefix}_{key}", "gauge", f"{what}: {key}", [({}, value)]
+            else:
+                yield f"{prefix}_{key}_total", "counter", f"{what}: {key}", [({}, value)]
+
+    registry.collector(collect)
+
+
+class ScopedCounter:
+    """Счётчик событий в пределах текущего контекста (например, одного запроса /route).
+
+    Задачи, порождённые внутри ``scope()``, наследуют его через ``contextvars``.
+    Области вкладываются: событие засчитывается каждой объемлющей области.
+    Вне области ``inc`` ничего не делает.
+    """
+
+    def __init__(self, name: str):
+        self._var: ContextVar[Tuple[List[int], ...]] = ContextVar(name, default=())
+
+    def inc(self, amount: int = 1) -> None:
+        for box in self._var.get():
+            box[0] += amount
+
+    @contextmanager
+    def scope(self) -> Iterator[List[int]]:
+        box = [0]
+        token = self._var.set(self._var.get() + (box,))
+        try:
+            yield box
+        finally:
+            self._var.reset(token)
+
+
+# Общие для интеграций метрики
+upstream_seconds = Histogram(
+    "upstream_request_seconds", "Latency of a single upstream HTTP call (one attempt)", ["upstream"]
+)
+upstream_errors = Counter(
+    "upstream_errors_total", "Upstream calls that failed or returned a non-2xx status", ["upstream"]
+)
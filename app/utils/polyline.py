@@ -0,0 +1,26 @@
+"""Encoded polyline (формат Google): компактная строка вместо массива координат."""
+
+from typing import List
+
+import numpy as np
+
+
+def encode_polyline(lat: np.ndarray, lon: np.ndarray, precision: int = 5) -> str:
+    """Кодирует точки (порядок ``lat, lon``, как в формате) с точностью ``10**-precision`` градуса."""
+    if len(lat) == 0:
+        return ""
+    factor = 10**precision
+    pts = np.empty((len(lat), 2), dtype=np.int64)
+    pts[:, 0] = np.round(np.asarray(lat, dtype=np.float64) * factor)
+    pts[:, 1] = np.round(np.asarray(lon, dtype=np.float64) * factor)
+    deltas = np.diff(pts, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    # zig-zag: знак в младший бит
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1).tolist()
+
+    out: List[str] = []
+    for v in values:
+        while v >= 0x20:
+            out.append(chr((0x20 | (v & 0x1F)) + 63))
+            v >>= 5
+        out.append(chr(v + 63))
+    return "".join(out)
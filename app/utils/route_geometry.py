@@ -0,0 +1,140 @@
+"""Векторизованная геометрия маршрута на NumPy.
+
+Кумулятивные расстояния по всей полилинии считаются один раз, после чего точки
+выборки для всех шагов получаются одним проходом ``searchsorted`` + интерполяция.
+Координаты хранятся в двух массивах float64 (16 байт на точку) вместо списка
+списков Python, так что исходный GeoJSON после разбора можно сразу отпустить.
+"""
+
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_np(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = np.radians(lon2 - lon1)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+class RouteGeometry:
+    """Полилиния маршрута (ORS ``[lon, lat]``) с предрасчитанными кумулятивными расстояниями."""
+
+    __slots__ = ("lat", "lon", "cum")
+
+    def __init__(self, coords_lonlat: Sequence[Sequence[float]]):
+        arr = np.asarray(coords_lonlat, dtype=np.float64).reshape(-1, 2)
+        self.lon = arr[:, 0]
+        self.lat = arr[:, 1]
+        self.cum = np.zeros(len(arr), dtype=np.float64)
+        if len(arr) > 1:
+            seg = haversine_np(self.lat[:-1], self.lon[:-1], self.lat[1:], self.lon[1:])
+            np.cumsum(seg, out=self.cum[1:])
+
+    def __len__(self) -> int:
+        return len(self.cum)
+
+    @property
+    def total_m(self) -> float:
+        return float(self.cum[-1]) if len(self.cum) else 0.0
+
+    def simplify(self, tolerance_m: float, keep: Sequence[int] = ()) -> np.ndarray:
+        """Индексы вершин, оставшихся после упрощения Дугласа–Пекера с допуском ``tolerance_m``.
+
+        Индексы из ``keep`` (например, начала шагов) сохраняются всегда. Расстояния
+        считаются в локальной равнопромежуточной проекции — на масштабе допуска
+        в метры-десятки метров её погрешность пренебрежима.
+        """
+        n = len(self.cum)
+        if n < 3 or tolerance_m <= 0:
+            return np.arange(n)
+        lat0 = np.radians(float(np.mean(self.lat)))
+        y = np.radians(self.lat) * EARTH_RADIUS_M
+        x = np.radians(self.lon) * EARTH_RADIUS_M * np.cos(lat0)
+
+        kept = np.zeros(n, dtype=bool)
+        kept[0] = kept[-1] = True
+        kept[[i for i in keep if 0 < i < n - 1]] = True
+        # точки, чей текущий отрезок уже укладывается в допуск
+        settled = np.zeros(n, dtype=bool)
+        # Все отрезки одного уровня рекурсии обрабатываются одним векторным проходом
+        while True:
+            idx = np.flatnonzero(~(kept | settled))
+            if len(idx) == 0:
+                break
+            anchors = np.flatnonzero(kept)
+            seg = np.searchsorted(anchors, idx) - 1
+            i, j = anchors[seg], anchors[seg + 1]
+            dx, dy = x[j] - x[i], y[j] - y[i]
+            px, py = x[idx] - x[i], y[idx] - y[i]
+            seg2 = dx * dx + dy * dy
+            # расстояние до отрезка (не до прямой): петли и развороты не теряются
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = np.where(seg2 > 0, np.clip((px * dx + py * dy) / seg2, 0.0, 1.0), 0.0)
+            d = np.hypot(px - t * dx, py - t * dy)
+
+            starts = np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]])
+            group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(idx)]))
+            dmax = np.maximum.reduceat(d, starts)
+            over = dmax[group] > tolerance_m
+            settled[idx[~over]] = True
+            # в каждом отрезке с превышением оставляем самую далёкую точку
+            far = over & (d == dmax[group])
+            _, first = np.unique(group[far], return_index=True)
+            kept[idx[far][first]] = True
+        return np.flatnonzero(kept)
+
+    def interpolate(self, dists: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Координаты точек на расстояниях ``dists`` (м от начала полилинии)."""
+        dists = np.clip(np.asarray(dists, dtype=np.float64), 0.0, self.total_m)
+        if len(self.cum) < 2:
+            return np.full_like(dists, self.lat[0]), np.full_like(dists, self.lon[0])
+        # первый индекс, где cum >= d; отрезок — [j, j + 1]
+        j = np.clip(np.searchsorted(self.cum, dists, side="left") - 1, 0, len(self.cum) - 2)
+        seg_len = self.cum[j + 1] - self.cum[j]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frac = np.where(seg_len > 0, (dists - self.cum[j]) / seg_len, 0.0)
+        lat = self.lat[j] + (self.lat[j + 1] - self.lat[j]) * frac
+        lon = self.lon[j] + (self.lon[j + 1] - self.lon[j]) * frac
+        return lat, lon
+
+    def sample_steps(
+        self,
+        bounds: Sequence[Tuple[int, int]],
+        interval_m: float,
+        max_points: int = 10,
+    ) -> List[List[Tuple[float, float]]]:
+        """Точки через каждые ``interval_m`` внутри каждого шага ``(i0, i1)``.
+
+        Семантика совпадает с ``app.utils.geo.sample_points_along``: первая точка на
+        ``interval_m`` от начала шага, строго до его конца, не более ``max_points``.
+        """
+        out: List[List[Tuple[float, float]]] = [[] for _ in bounds]
+        if not bounds or len(self.cum) < 2:
+            return out
+        b = np.asarray(bounds, dtype=np.int64).reshape(-1, 2)
+        start = self.cum[b[:, 0]]
+        total = self.cum[b[:, 1]] - start
+        counts = np.where(total < interval_m, 0, np.ceil(total / interval_m) - 1)
+        counts = np.clip(counts, 0, max_points).astype(np.int64)
+        n = int(counts.sum())
+        if n == 0:
+            return out
+
+        owner = np.repeat(np.arange(len(b)), counts)
+        first = np.cumsum(counts) - counts
+        k = np.arange(n) - np.repeat(first, counts) + 1
+        offset = k * interval_m
+        keep = offset < total[owner]
+        owner, offset = owner[keep], offset[keep]
+        lat, lon = self.interpolate(start[owner] + offset)
+        lat = np.round(lat, 6).tolist()
+        lon = np.round(lon, 6).tolist()
+        for o, la, lo in zip(owner.tolist(), lat, lon):
+            out[o].append((la, lo))
+        return out
@@ -0,0 +1,64 @@
+"""Локальный подсчёт токенов для бюджетирования истории диалога.
+
+Используется ``tiktoken``, если он установлен и словарь кодировки доступен (при
+первом обращении он скачивается без таймаута и кешируется; для окружений без сети
+словарь можно положить заранее в ``TIKTOKEN_CACHE_DIR``). Иначе — консервативная
+оценка по длине текста: для смеси кириллицы и латиницы это ~3 символа на токен.
+
+Сервис загружает кодировку при старте фоновым потоком (``warm_up``): пока загрузка
+идёт или если она зависла, ``count_tokens`` отвечает оценкой и не блокирует запрос.
+"""
+
+import threading
+from functools import lru_cache
+from typing import Dict, Optional
+
+from app.config import logger
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+_FALLBACK_ENCODING = "o200k_base"
+
+# модель → поток загрузки кодировки, запущенный ``warm_up``
+_warmups: Dict[Optional[str], threading.Thread] = {}
+_warmups_lock = threading.Lock()
+
+
+@lru_cache(maxsize=8)
+def _encoding(model_name: Optional[str]):
+    if tiktoken is None:
+        return None
+    try:
+        if model_name:
+            try:
+                return tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                pass
+        return tiktoken.get_encoding(_FALLBACK_ENCODING)
+    except Exception as e:
+        logger.warning("tiktoken unavailable, falling back to length-based token estimate: {}", e)
+        return None
+
+
+def warm_up(model_name: Optional[str] = None) -> threading.Thread:
+    """Загружает кодировку для модели в фоновом потоке (повторные вызовы — тот же поток)."""
+    with _warmups_lock:
+        thread = _warmups.get(model_name)
+        if thread is None:
+            thread = threading.Thread(target=_encoding, args=(model_name,), name="tiktoken-warmup", daemon=True)
+            _warmups[model_name] = thread
+            thread.start()
+    return thread
+
+
+def count_tokens(text: str, model_name: Optional[str] = None) -> int:
+    if not text:
+        return 0
+    warming = _warmups.get(model_name)
+    enc = None if warming is not None and warming.is_alive() else _encoding(model_name)
+    if enc is None:
+        return (len(text) + 2) // 3
+    return len(enc.encode(text, disallowed_special=()))
@@ -0,0 +1,93 @@
+"""Разбивка времени запроса по фазам.
+
+``start_trace`` открывает трассу на время обработки запроса, ``span`` внутри неё
+добавляет длительность фазы. Трасса живёт в ``contextvars``, поэтому задачи,
+созданные внутри запроса, пишут в ту же трассу. Вне трассы ``span`` ничего не
+делает, и пакетный режим с CLI не платят за инструментирование.
+
+Длительности одноимённых фаз суммируются: параллельное геокодирование двух точек
+даёт ``geocode`` больше настенного времени — это суммарная работа, а не отрезок.
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+from app.config import logger, settings
+
+
+class Trace:
+    __slots__ = ("name", "started", "spans")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        # фаза → [суммарная длительность, с; число вызовов]
+        self.spans: Dict[str, List[float]] = {}
+
+    def add(self, phase: str, duration_s: float) -> None:
+        acc = self.spans.get(phase)
+        if acc is None:
+            self.spans[phase] = [duration_s, 1]
+        else:
+            acc[0] += duration_s
+            acc[1] += 1
+
+    @property
+    def elapsed_s(self) -> float:
+        return time.perf_counter() - self.started
+
+    def breakdown(self) -> Dict[str, float]:
+        """Фаза → миллисекунды (в порядке первого появления) плюс ``total``."""
+        out = {phase: round(dur * 1000, 2) for phase, (dur, _) in self.spans.items()}
+        out["total"] = round(self.elapsed_s * 1000, 2)
+        return out
+
+    def server_timing(self) -> str:
+        """Значение заголовка ``Server-Timing``."""
+        return ", ".join(f"{phase};dur={ms}" for phase, ms in self.breakdown().items())
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(phase: str) -> Iterator[None]:
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(phase, time.perf_counter() - t0)
+
+
+@contextmanager
+def start_trace(name: str) -> Iterator[Trace]:
+    """Трасса на время блока; по выходе часть трасс (и все медленные) пишется в лог."""
+    trace = Trace(name)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        _log_sampled(trace)
+
+
+def _log_sampled(trace: Trace) -> None:
+    elapsed_ms = trace.elapsed_s * 1000
+    slow = settings.trace_slow_ms > 0 and elapsed_ms >= settings.trace_slow_ms
+    if not slow and random.random() >= settings.trace_sample_rate:
+        return
+    phases = {phase: {"ms": round(dur * 1000, 2), "calls": int(n)} for phase, (dur, n) in trace.spans.items()}
+    logger.bind(trace={"name": trace.name, "total_ms": round(elapsed_ms, 2), "slow": slow, "phases": phases}).info(
+        "Trace {}: {:.1f} ms {}", trace.name, elapsed_ms, trace.server_timing()
+    )
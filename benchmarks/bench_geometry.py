@@ -0,0 +1,152 @@
+"""Сравнение векторизованного RouteGeometry с прежним построчным sample_points_along,
+плюс память геометрии и размер упрощённой encoded polyline.
+
+Запуск::
+
+    python -m benchmarks.bench_geometry --vertices 50000 --steps 400
+"""
+
+import argparse
+import json
+import math
+import random
+import time
+import tracemalloc
+from typing import List, Tuple
+
+from app.utils.geo import haversine_m, round6
+from app.utils.polyline import encode_polyline
+from app.utils.route_geometry import RouteGeometry
+
+
+def sample_points_along_py(
+    coords_lonlat: List[List[float]], interval_m: float, max_points: int = 10
+) -> List[Tuple[float, float]]:
+    """Эталон: реализация ``sample_points_along`` до перехода на NumPy."""
+    if len(coords_lonlat) < 2:
+        return []
+    seg_len: List[float] = []
+    total = 0.0
+    for i in range(len(coords_lonlat) - 1):
+        lon1, lat1 = coords_lonlat[i]
+        lon2, lat2 = coords_lonlat[i + 1]
+        d = haversine_m(lat1, lon1, lat2, lon2)
+        seg_len.append(d)
+        total += d
+    if total < interval_m:
+        return []
+
+    targets = []
+    k = 1
+    while k * interval_m < total and len(targets) < max_points:
+        targets.append(k * interval_m)
+        k += 1
+
+    pts: List[Tuple[float, float]] = []
+    acc = 0.0
+    seg_idx = 0
+    for tdist in targets:
+        while seg_idx < len(seg_len) and acc + seg_len[seg_idx] < tdist:
+            acc += seg_len[seg_idx]
+            seg_idx += 1
+        if seg_idx >= len(seg_len):
+            break
+        remain = tdist - acc
+        frac = 0.0 if seg_len[seg_idx] == 0 else (remain / seg_len[seg_idx])
+        lon1, lat1 = coords_lonlat[seg_idx]
+        lon2, lat2 = coords_lonlat[seg_idx + 1]
+        pts.append((round6(lat1 + (lat2 - lat1) * frac), round6(lon1 + (lon2 - lon1) * frac)))
+    return pts
+
+
+def synthetic_route(n_vertices: int, seed: int = 1) -> List[List[float]]:
+    """Ломаная ~3000 км на северо-восток от Москвы с шумом, как у реальной трассы."""
+    rnd = random.Random(seed)
+    lat, lon = 55.75, 37.62
+    coords = [[lon, lat]]
+    step_deg = 27.0 / n_vertices
+    for _ in range(n_vertices - 1):
+        lat += step_deg * 0.3 + rnd.uniform(-1, 1) * step_deg * 0.2
+        lon += step_deg + rnd.uniform(-1, 1) * step_deg * 0.2
+        coords.append([lon, lat])
+    return coords
+
+
+def split_steps(n_vertices: int, n_steps: int) -> List[Tuple[int, int]]:
+    cuts = sorted(random.Random(2).sample(range(1, n_vertices - 1), n_steps - 1))
+    edges = [0] + cuts + [n_vertices - 1]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def bench(fn, repeat: int) -> float:
+    best = math.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def traced(fn) -> Tuple[object, int, int]:
+    """Результат ``fn``, удерживаемая им память и пик выделений за вызов (байт)."""
+    tracemalloc.start()
+    try:
+        res = fn()
+        current, peak = tracemalloc.get_traced_memory()
+        return res, current, peak
+    finally:
+        tracemalloc.stop()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--vertices", type=int, default=50_000)
+    ap.add_argument("--steps", type=int, default=400)
+    ap.add_argument("--interval", type=float, default=5000.0)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--tolerance", type=float, default=10.0, help="допуск упрощения, м")
+    args = ap.parse_args()
+
+    coords = synthetic_route(args.vertices)
+    bounds = split_steps(args.vertices, args.steps)
+
+    def legacy():
+        return [sample_points_along_py(coords[i0 : i1 + 1], args.interval, 10) for i0, i1 in bounds]
+
+    def vectorized():
+        return RouteGeometry(coords).sample_steps(bounds, args.interval, 10)
+
+    ref, new = legacy(), vectorized()
+    mismatched = sum(
+        1
+        for a, b in zip(ref, new)
+        if len(a) != len(b) or any(abs(x - y) > 2e-6 for pa, pb in zip(a, b) for x, y in zip(pa, pb))
+    )
+    t_legacy = bench(legacy, args.repeat)
+    t_vec = bench(vectorized, args.repeat)
+    n_pts = sum(len(p) for p in new)
+    print(f"vertices={args.vertices} steps={args.steps} sample_points={n_pts} mismatched_steps={mismatched}")
+    print(f"legacy per-step loop : {t_legacy * 1000:8.2f} ms")
+    print(f"RouteGeometry        : {t_vec * 1000:8.2f} ms  (x{t_legacy / t_vec:.1f})")
+
+    # Память: геометрия как её отдаёт json.loads, против массивов RouteGeometry
+    raw = json.dumps(coords)
+    lists, mem_lists, _ = traced(lambda: json.loads(raw))
+    geom, mem_geom, peak_geom = traced(lambda: RouteGeometry(lists))
+    print(
+        f"geometry memory      : lists {mem_lists / 2**20:.1f} MiB -> arrays {mem_geom / 2**20:.1f} MiB "
+        f"(peak while building {peak_geom / 2**20:.1f} MiB)"
+    )
+
+    t0 = time.perf_counter()
+    keep = geom.simplify(args.tolerance, [b[0] for b in bounds])
+    line = encode_polyline(geom.lat[keep], geom.lon[keep])
+    t_simpl = time.perf_counter() - t0
+    print(
+        f"{f'simplify {args.tolerance:g} m':<21}: {len(geom)} -> {len(keep)} points, "
+        f"polyline {len(line)} chars vs json {len(raw)} ({t_simpl * 1000:.1f} ms)"
+    )
+
+
+if __name__ == "__main__":
+    main()
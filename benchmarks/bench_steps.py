@@ -0,0 +1,143 @@
+"""CPU на шаги маршрута: pydantic-модели на всём пути против dataclass-записей
+с однократным переводом в схему ответа.
+
+Прежний путь: ``StepOut``/``ViaLocality`` с валидацией при создании, затем
+``serialize_response`` FastAPI по ``response_model`` (dump → повторная валидация →
+jsonable_encoder → json). Новый: ``RouteStep``, одна валидация ``RouteResponse`` из
+словарей и ``model_dump_json``. Для сравнения — вариант с ``model_construct``.
+
+Запуск::
+
+    python -m benchmarks.bench_steps --steps 600
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import time
+from typing import Any, Dict, List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+from app.api.routes import router
+from app.api.schemas import RouteResponse, StepOut, ViaLocality
+from app.services.route_steps import RouteStep, ViaPoint
+from app.utils.geo import round6
+
+_loop = asyncio.new_event_loop()
+_route_field = next(r.response_field for r in router.routes if getattr(r, "path", None) == "/route")
+
+
+def synthetic_steps(n: int) -> List[Dict[str, Any]]:
+    """Шаги в том виде, как их читает ``ors_extract_steps``."""
+    return [
+        {
+            "lat": 55.75 + i * 0.01,
+            "lon": 37.62 + i * 0.02,
+            "distance": 1234.5 + i,
+            "duration": 98.7 + i,
+            "instruction": f"Поверните направо на улицу {i}",
+            "name": f"Улица {i}",
+        }
+        for i in range(n)
+    ]
+
+
+def enrich(steps) -> None:
+    # как в RouteEnrichmentPlanner._apply: locality на каждом шаге, промежуточные пункты на каждом третьем
+    for s in steps:
+        s.locality = f"Город{s.idx // 7}"
+
+
+def legacy(raw: List[Dict[str, Any]]) -> bytes:
+    steps = [
+        StepOut(
+            idx=i,
+            start_lat=round6(st["lat"]),
+            start_lon=round6(st["lon"]),
+            distance_m=int(round(st["distance"])),
+            duration_s=int(round(st["duration"])),
+            instruction=st["instruction"],
+            street=st["name"],
+            locality=None,
+        )
+        for i, st in enumerate(raw)
+    ]
+    enrich(steps)
+    for s in steps[::3]:
+        s.via_localities = [ViaLocality(name=f"Село{s.idx}", lat=s.start_lat, lon=s.start_lon)]
+    resp = RouteResponse(ok=True, markdown="", steps=steps)
+    content = _loop.run_until_complete(serialize_response(field=_route_field, response_content=resp))
+    return JSONResponse(content).body
+
+
+def compact_steps(raw: List[Dict[str, Any]]) -> List[RouteStep]:
+    steps = [
+        RouteStep(
+            idx=i,
+            leg=0,
+            start_lat=round6(st["lat"]),
+            start_lon=round6(st["lon"]),
+            distance_m=int(round(st["distance"])),
+            duration_s=int(round(st["duration"])),
+            instruction=st["instruction"],
+            street=st["name"],
+        )
+        for i, st in enumerate(raw)
+    ]
+    enrich(steps)
+    for s in steps[::3]:
+        s.via_localities = [ViaPoint(f"Село{s.idx}", s.start_lat, s.start_lon)]
+    return steps
+
+
+def compact(raw: List[Dict[str, Any]]) -> bytes:
+    resp = RouteResponse(ok=True, markdown="", steps=[s.to_dict() for s in compact_steps(raw)])
+    return resp.model_dump_json().encode("utf-8")
+
+
+def constructed(raw: List[Dict[str, Any]]) -> bytes:
+    steps = []
+    for s in compact_steps(raw):
+        d = s.to_dict()
+        if d["via_localities"]:
+            d["via_localities"] = [ViaLocality.model_construct(**v) for v in d["via_localities"]]
+        steps.append(StepOut.model_construct(**d))
+    resp = RouteResponse.model_construct(ok=True, markdown="", steps=steps, geometry=None, type="result", message=None)
+    return resp.model_dump_json().encode("utf-8")
+
+
+def bench(fn, repeat: int) -> float:
+    best = math.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--steps", type=int, default=600)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    raw = synthetic_steps(args.steps)
+    ref = json.loads(legacy(raw))
+    same = ref == json.loads(compact(raw)) == json.loads(constructed(raw))
+    t_legacy = bench(lambda: legacy(raw), args.repeat)
+    t_compact = bench(lambda: compact(raw), args.repeat)
+    t_constructed = bench(lambda: constructed(raw), args.repeat)
+    print(f"steps={args.steps} identical_json={same}")
+    print(f"pydantic end-to-end    : {t_legacy * 1000:8.2f} ms")
+    print(
+        f"RouteStep + validate   : {t_compact * 1000:8.2f} ms  (x{t_legacy / t_compact:.1f}, "
+        f"-{(t_legacy - t_compact) * 1000:.2f} ms per request)"
+    )
+    print(f"RouteStep + construct  : {t_constructed * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""Локальные заглушки ORS, Yandex Geocoder и OpenAI Responses API для нагрузочных тестов.
+
+Ответы повторяют форму настоящих API (GeoJSON ORS с сегментами и шагами, ответ
+геокодера с ``metaDataProperty``/``boundedBy``, объект Response и SSE-события
+Responses API), детерминированы по входу и настраиваются по размеру, задержке
+и доле ошибок. Вместо сгенерированного маршрута можно отдавать записанный ответ
+ORS (``--ors-payload``).
+
+Запуск::
+
+    python -m benchmarks.fake_upstreams --port 9100 --latency-ms 80 --error-rate 0.01
+
+Сервис подключается через настройки::
+
+    YANDEX_GEOCODER_URL=http://127.0.0.1:9100/yandex/v1
+    ORS_DIRECTIONS_URL=http://127.0.0.1:9100/ors/v2/directions/driving-car/geojson
+    OPENAI_BASE_URL=http://127.0.0.1:9100/openai/v1
+
+``GET /__stats`` — счётчики вызовов по upstream, ``POST /__reset`` — обнуление.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import math
+import random
+import time
+import uuid
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from app.utils.fastjson import dumps, loads
+from app.utils.geo import haversine_m
+
+
+class FakeConfig:
+    def __init__(self, args: argparse.Namespace):
+        self.latency = {
+            "ors": args.ors_latency_ms if args.ors_latency_ms is not None else args.latency_ms,
+            "yandex": args.yandex_latency_ms if args.yandex_latency_ms is not None else args.latency_ms,
+            "openai": args.openai_latency_ms if args.openai_latency_ms is not None else args.latency_ms,
+        }
+        self.jitter = args.jitter
+        self.error_rate = args.error_rate
+        self.vertex_spacing_m = args.vertex_spacing_m
+        self.step_m = args.step_m
+        self.locality_cell_deg = args.locality_cell_deg
+        self.rural_share = args.rural_share
+        self.reply_tokens = args.reply_tokens
+        self.token_ms = args.token_ms
+        self.ors_payload: Optional[bytes] = args.ors_payload.read_bytes() if args.ors_payload else None
+
+
+def _seed(*parts: Any) -> int:
+    return int.from_bytes(hashlib.blake2b(repr(parts).encode(), digest_size=8).digest(), "big")
+
+
+# --- ORS ---------------------------------------------------------------------------------------
+
+_INSTRUCTIONS = ["Двигайтесь прямо", "Поверните направо", "Поверните налево", "Держитесь правее", "Съезд"]
+
+
+@lru_cache(maxsize=256)
+def ors_payload(coords: Tuple[Tuple[float, float], ...], spacing_m: float, step_m: float) -> bytes:
+    """GeoJSON-ответ ORS: ломаная с шумом через все точки, сегмент на участок, шаг каждые ~``step_m``."""
+    rnd = random.Random(_seed(coords))
+    line: List[List[float]] = [[coords[0][0], coords[0][1]]]
+    segments = []
+    total_d = total_t = 0.0
+    for (lon0, lat0), (lon1, lat1) in zip(coords[:-1], coords[1:]):
+        direct = haversine_m(lat0, lon0, lat1, lon1)
+        n = max(2, int(direct * 1.25 / spacing_m))
+        start = len(line) - 1
+        for k in range(1, n + 1):
+            t = k / n
+            wobble = 0.0 if k == n else math.sin(t * math.pi * 7) * 0.01 + rnd.uniform(-1, 1) * 0.0004
+            line.append([round(lon0 + (lon1 - lon0) * t + wobble, 6), round(lat0 + (lat1 - lat0) * t - wobble, 6)])
+        seg_d = direct * 1.25
+        seg_t = seg_d / 22.0  # ~80 км/ч
+        per = max(1, int(n * step_m / seg_d))
+        steps = []
+        for i0 in range(start, start + n, per):
+            i1 = min(i0 + per, start + n)
+            frac = (i1 - i0) / n
+            steps.append(
+                {
+                    "distance": round(seg_d * frac, 1),
+                    "duration": round(seg_t * frac, 1),
+                    "type": rnd.randrange(0, 7),
+                    "instruction": f"{rnd.choice(_INSTRUCTIONS)} на трассу Р-{rnd.randrange(1, 300)}",
+                    "name": f"Р-{rnd.randrange(1, 300)}",
+                    "way_points": [i0, i1],
+                }
+            )
+        steps.append(
+            {
+                "distance": 0.0,
+                "duration": 0.0,
+                "type": 10,
+                "instruction": "Прибытие",
+                "name": "-",
+                "way_points": [i1, i1],
+            }
+        )
+        segments.append({"distance": round(seg_d, 1), "duration": round(seg_t, 1), "steps": steps})
+        total_d += seg_d
+        total_t += seg_t
+
+    lons = [p[0] for p in line]
+    lats = [p[1] for p in line]
+    bbox = [min(lons), min(lats), max(lons), max(lats)]
+    return dumps(
+        {
+            "type": "FeatureCollection",
+            "bbox": bbox,
+            "features": [
+                {
+                    "bbox": bbox,
+                    "type": "Feature",
+                    "properties": {
+                        "segments": segments,
+                        "way_points": [0, len(line) - 1],
+                        "summary": {"distance": round(total_d, 1), "duration": round(total_t, 1)},
+                    },
+                    "geometry": {"coordinates": line, "type": "LineString"},
+                }
+            ],
+            "metadata": {
+                "attribution": "openrouteservice.org | OpenStreetMap contributors",
+                "service": "routing",
+                "timestamp": int(time.time() * 1000),
+                "query": {"coordinates": [list(c) for c in coords], "profile": "driving-car", "format": "geojson"},
+                "engine": {"version": "fake", "build_date": "", "graph_date": ""},
+            },
+        }
+    )
+
+
+# --- Yandex ------------------------------------------------------------------------------------
+
+
+def _geo_object(name: str, kind: str, lat: float, lon: float, env: List[float], components: List[Dict[str, str]]):
+    formatted = ", ".join(c["name"] for c in components)
+    return {
+        "GeoObject": {
+            "metaDataProperty": {
+                "GeocoderMetaData": {
+                    "precision": "other",
+                    "text": formatted,
+                    "kind": kind,
+                    "Address": {"country_code": "RU", "formatted": formatted, "Components": components},
+                }
+            },
+            "name": name,
+            "description": ", ".join(c["name"] for c in components[:-1]),
+            "boundedBy": {"Envelope": {"lowerCorner": f"{env[1]} {env[0]}", "upperCorner": f"{env[3]} {env[2]}"}},
+            "uri": f"ymapsbm1://geo?data={uuid.UUID(int=_seed(name) << 64 | _seed(kind))}",
+            "Point": {"pos": f"{lon:.6f} {lat:.6f}"},
+        }
+    }
+
+
+def _collection(request: str, members: List[Dict[str, Any]]) -> bytes:
+    return dumps(
+        {
+            "response": {
+                "GeoObjectCollection": {
+                    "metaDataProperty": {
+                        "GeocoderResponseMetaData": {"request": request, "results": "1", "found": str(len(members))}
+                    },
+                    "featureMember": members,
+                }
+            }
+        }
+    )
+
+
+def yandex_forward(address: str) -> bytes:
+    rnd = random.Random(_seed("fwd", address.lower()))
+    lat, lon = rnd.uniform(50.0, 60.0), rnd.uniform(30.0, 50.0)
+    comps = [{"kind": "country", "name": "Россия"}, {"kind": "locality", "name": address}]
+    env = [lat - 0.05, lon - 0.08, lat + 0.05, lon + 0.08]
+    return _collection(address, [_geo_object(address, "locality", lat, lon, env, comps)])
+
+
+def yandex_reverse(lat: float, lon: float, cfg: FakeConfig) -> bytes:
+    c = cfg.locality_cell_deg
+    ci, cj = math.floor(lat / c), math.floor(lon / c)
+    province = f"Область {math.floor(lat)}-{math.floor(lon)}"
+    comps = [{"kind": "country", "name": "Россия"}, {"kind": "province", "name": province}]
+    if random.Random(_seed("rural", ci, cj)).random() < cfg.rural_share:
+        env = [math.floor(lat), math.floor(lon), math.floor(lat) + 1, math.floor(lon) + 1]
+        member = _geo_object(province, "province", lat, lon, env, comps)
+    else:
+        name = f"Посёлок {ci}-{cj}"
+        comps.append({"kind": "locality", "name": name})
+        env = [ci * c, cj * c, (ci + 1) * c, (cj + 1) * c]
+        member = _geo_object(name, "locality", (ci + 0.5) * c, (cj + 0.5) * c, env, comps)
+    return _collection(f"{lat},{lon}", [member])
+
+
+# --- OpenAI ------------------------------------------------------------------------------------
+
+
+def _response_object(resp_id: str, model: str, text: str, prompt_chars: int) -> Dict[str, Any]:
+    return {
+        "id": resp_id,
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": "completed",
+        "error": None,
+        "incomplete_details": None,
+        "instructions": None,
+        "max_output_tokens": None,
+        "model": model,
+        "output": [
+            {
+                "type": "message",
+                "id": "msg_" + resp_id[5:],
+                "status": "completed",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }
+        ],
+        "parallel_tool_calls": True,
+        "previous_response_id": None,
+        "reasoning": {"effort": None, "summary": None},
+        "store": True,
+        "temperature": 1.0,
+        "text": {"format": {"type": "text"}},
+        "tool_choice": "auto",
+        "tools": [],
+        "top_p": 1.0,
+        "truncation": "disabled",
+        "usage": {
+            "input_tokens": prompt_chars // 3,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": len(text) // 3,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": (prompt_chars + len(text)) // 3,
+        },
+        "user": None,
+        "metadata": {},
+    }
+
+
+def _reply_tokens(n: int, seed: int) -> List[str]:
+    rnd = random.Random(seed)
+    words = ["дорога", "маршрут", "город", "трасса", "поворот", "заправка", "мост", "река", "съезд", "кафе"]
+    return [("" if i == 0 else " ") + rnd.choice(words) for i in range(n)]
+
+
+def _sse(event: Dict[str, Any]) -> bytes:
+    return b"event: " + event["type"].encode() + b"\ndata: " + dumps(event) + b"\n\n"
+
+
+# --- app ---------------------------------------------------------------------------------------
+
+
+def create_fake_app(cfg: FakeConfig) -> FastAPI:
+    app = FastAPI(title="Fake upstreams")
+    calls: Counter = Counter()
+    response_ids: "OrderedDict[str, None]" = OrderedDict()
+
+    async def delay(service: str) -> None:
+        base = cfg.latency[service] / 1000
+        if base > 0:
+            await asyncio.sleep(max(0.0, random.gauss(base, base * cfg.jitter)))
+
+    def failure(service: str) -> Optional[Response]:
+        if cfg.error_rate > 0 and random.random() < cfg.error_rate:
+            calls[f"{service}_errors"] += 1
+            status = random.choice((429, 500, 503))
+            headers = {"Retry-After": "0"} if status == 429 else None
+            return JSONResponse({"error": {"message": "fake upstream error"}}, status_code=status, headers=headers)
+        return None
+
+    @app.get("/__stats")
+    def stats() -> Dict[str, int]:
+        return dict(calls)
+
+    @app.post("/__reset")
+    def reset() -> Dict[str, bool]:
+        calls.clear()
+        return {"ok": True}
+
+    @app.post("/ors/v2/directions/{profile}/geojson")
+    async def ors(request: Request) -> Response:
+        calls["ors"] += 1
+        await delay("ors")
+        if (err := failure("ors")) is not None:
+            return err
+        if cfg.ors_payload is not None:
+            return Response(cfg.ors_payload, media_type="application/json")
+        body = loads(await request.body())
+        coords = tuple((float(lon), float(lat)) for lon, lat in body["coordinates"])
+        return Response(ors_payload(coords, cfg.vertex_spacing_m, cfg.step_m), media_type="application/json")
+
+    @app.get("/yandex/v1")
+    async def yandex(geocode: str, sco: Optional[str] = None) -> Response:
+        kind = "reverse" if sco == "latlong" else "forward"
+        calls[f"yandex_{kind}"] += 1
+        await delay("yandex")
+        if (err := failure("yandex")) is not None:
+            return err
+        if kind == "forward":
+            return Response(yandex_forward(geocode), media_type="application/json")
+        lat, lon = (float(x) for x in geocode.split(","))
+        return Response(yandex_reverse(lat, lon, cfg), media_type="application/json")
+
+    @app.post("/openai/v1/responses")
+    async def responses(request: Request) -> Response:
+        calls["openai"] += 1
+        body = loads(await request.body())
+        prev = body.get("previous_response_id")
+        if prev and prev not in response_ids:
+            calls["openai_chain_misses"] += 1
+            msg = f"Previous response with id '{prev}' not found."
+            return JSONResponse({"error": {"message": msg, "type": "invalid_request_error"}}, status_code=404)
+        await delay("openai")
+        if (err := failure("openai")) is not None:
+            return err
+
+        prompt_chars = len(dumps(body.get("input")))
+        calls["openai_input_bytes"] += prompt_chars
+        resp_id = f"resp_{uuid.uuid4().hex}"
+        response_ids[resp_id] = None
+        while len(response_ids) > 100_000:
+            response_ids.popitem(last=False)
+        tokens = _reply_tokens(cfg.reply_tokens, _seed(prompt_chars))
+        final = _response_object(resp_id, body.get("model", "fake"), "".join(tokens), prompt_chars)
+        if not body.get("stream"):
+            return Response(dumps(final), media_type="application/json")
+
+        async def events():
+            seq = 0
+            created = {**final, "status": "in_progress", "output": [], "usage": None}
+            yield _sse({"type": "response.created", "response": created, "sequence_number": seq})
+            item_id = final["output"][0]["id"]
+            for tok in tokens:
+                if cfg.token_ms > 0:
+                    await asyncio.sleep(cfg.token_ms / 1000)
+                seq += 1
+                yield _sse(
+                    {
+                        "type": "response.output_text.delta",
+                        "item_id": item_id,
+                        "output_index": 0,
+                        "content_index": 0,
+                        "delta": tok,
+                        "logprobs": [],
+                        "sequence_number": seq,
+                    }
+                )
+            yield _sse({"type": "response.completed", "response": final, "sequence_number": seq + 1})
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9100)
+    ap.add_argument("--latency-ms", type=float, default=50.0, help="средняя задержка ответа")
+    ap.add_argument("--ors-latency-ms", type=float, default=None)
+    ap.add_argument("--yandex-latency-ms", type=float, default=None)
+    ap.add_argument("--openai-latency-ms", type=float, default=None)
+    ap.add_argument("--jitter", type=float, default=0.3, help="σ задержки как доля среднего")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429/500/503")
+    ap.add_argument("--vertex-spacing-m", type=float, default=40.0, help="шаг вершин линии ORS")
+    ap.add_argument("--step-m", type=float, default=2000.0, help="средняя длина шага ORS")
+    ap.add_argument("--ors-payload", type=Path, default=None, help="записанный ответ ORS для всех запросов")
+    ap.add_argument("--locality-cell-deg", type=float, default=0.08, help="размер «населённого пункта»")
+    ap.add_argument("--rural-share", type=float, default=0.3, help="доля ячеек без населённого пункта")
+    ap.add_argument("--reply-tokens", type=int, default=200, help="длина ответа модели")
+    ap.add_argument("--token-ms", type=float, default=5.0, help="пауза между SSE-дельтами")
+    return ap
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    uvicorn.run(create_fake_app(FakeConfig(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""Нагрузочный прогон /route и /chat с отчётом p50/p95/p99, RPS и вызовов upstream на запрос.
+
+С ``--spawn`` поднимает заглушки upstream (``benchmarks.fake_upstreams``) и сам сервис
+в дочерних процессах с чистыми кешами; без него бьёт в уже запущенные ``--url`` и
+``--fake-url``. Результат можно сохранить и сравнить с базовым прогоном::
+
+    python -m benchmarks.load --spawn --scenario route --requests 300 --concurrency 16 --save base.json
+    python -m benchmarks.load --spawn --scenario route --requests 300 --concurrency 16 --compare base.json
+
+Сценарии: ``route``, ``route_stream``, ``route_batch``, ``chat``, ``chat_stream``.
+``--unique`` ограничивает число разных маршрутов (остальные запросы — повторы, т.е. тёплые кеши).
+Лимит частоты геокодера по умолчанию выключен; чтобы мерить сервис под квотой провайдера,
+его можно задать: ``--env GEOCODER_RATE_LIMIT_RPS=20``.
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.utils.fastjson import dumps, loads
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    s = sorted(values)
+    k = (len(s) - 1) * q
+    lo, hi = math.floor(k), math.ceil(k)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def route_bodies(n: int, route_km: float, waypoints: int, seed: int = 7) -> List[Dict[str, Any]]:
+    """Пул разных запросов /route: A — адресом (прямое геокодирование), B — координатами."""
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        lat, lon = rnd.uniform(52.0, 58.0), rnd.uniform(34.0, 46.0)
+        ang = rnd.uniform(0, 2 * math.pi)
+        d_deg = route_km / 111.0
+        b = {"lat": round(lat + d_deg * math.sin(ang), 5), "lon": round(lon + d_deg * math.cos(ang) * 1.7, 5)}
+        body: Dict[str, Any] = {"a": {"address": f"Город {i}"}, "b": b}
+        if waypoints:
+            body["waypoints"] = [
+                {
+                    "lat": round(lat + (b["lat"] - lat) * k / (waypoints + 1), 5),
+                    "lon": round(lon + (b["lon"] - lon) * k / (waypoints + 1), 5),
+                }
+                for k in range(1, waypoints + 1)
+            ]
+        out.append(body)
+    return out
+
+
+class Runner:
+    def __init__(self, args: argparse.Namespace, client: httpx.AsyncClient):
+        self.args = args
+        self.client = client
+        self.routes = route_bodies(args.unique, args.route_km, args.waypoints)
+        self.latencies: List[float] = []
+        self.ttfb: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.items = 0
+        self.conversations: Dict[int, Optional[str]] = {}
+
+    def _error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    async def one(self, i: int) -> None:
+        scenario = self.args.scenario
+        t0 = time.perf_counter()
+        try:
+            if scenario in ("route", "route_stream", "route_batch"):
+                await getattr(self, scenario)(i, t0)
+            else:
+                await self.chat(i, t0, stream=scenario == "chat_stream")
+        except httpx.HTTPError as e:
+            self._error(type(e).__name__)
+            return
+        self.latencies.append(time.perf_counter() - t0)
+
+    async def route(self, i: int, t0: float) -> None:
+        r = await self.client.post("/api/route", json=self.routes[i % len(self.routes)])
+        self.ttfb.append(time.perf_counter() - t0)
+        self.items += 1
+        if r.status_code != 200:
+            self._error(f"http_{r.status_code}")
+        elif not loads(r.content).get("ok"):
+            self._error("route_not_ok")
+
+    async def route_stream(self, i: int, t0: float) -> None:
+        async with self.client.stream("POST", "/api/route/stream", json=self.routes[i % len(self.routes)]) as r:
+            first = True
+            async for line in r.aiter_lines():
+                if first:
+                    self.ttfb.append(time.perf_counter() - t0)
+                    first = False
+                if line and loads(line).get("type") == "error":
+                    self._error("route_not_ok")
+        self.items += 1
+
+    async def route_batch(self, i: int, t0: float) -> None:
+        size = self.args.batch_size
+        items = [self.routes[(i * size + k) % len(self.routes)] for k in range(size)]
+        async with self.client.stream("POST", "/api/route/batch", json={"items": items}) as r:
+            first = True
+            async for line in r.aiter_lines():
+                if not line:
+                    continue
+                if first:
+                    self.ttfb.append(time.perf_counter() - t0)
+                    first = False
+                ev = loads(line)
+                if ev.get("type") == "item":
+                    self.items += 1
+                    if not ev["result"]["ok"]:
+                        self._error("route_not_ok")
+
+    async def chat(self, i: int, t0: float, stream: bool) -> None:
+        # ``--turns`` реплик на диалог: история растёт как у настоящего пользователя
+        conv_slot = i // self.args.turns
+        body = {
+            "user_text": f"Что посмотреть по дороге? Вопрос {i}",
+            "conversation_id": self.conversations.get(conv_slot),
+        }
+        if not stream:
+            r = await self.client.post("/api/chat", json=body)
+            self.ttfb.append(time.perf_counter() - t0)
+            if r.status_code != 200:
+                self._error(f"http_{r.status_code}")
+                return
+            self.conversations[conv_slot] = loads(r.content)["conversation_id"]
+        else:
+            async with self.client.stream("POST", "/api/chat/stream", json=body) as r:
+                first = True
+                async for line in r.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    ev = loads(line[6:])
+                    if ev["type"] == "delta" and first:
+                        self.ttfb.append(time.perf_counter() - t0)
+                        first = False
+                    elif ev["type"] == "start":
+                        self.conversations[conv_slot] = ev["conversation_id"]
+                    elif ev["type"] == "error":
+                        self._error("stream_error")
+        self.items += 1
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout) as client, httpx.AsyncClient(
+        base_url=args.fake_url, timeout=10
+    ) as fake:
+        runner = Runner(args, client)
+        if args.warmup:
+            # прогрев: каждый уникальный маршрут один раз, в статистику не входит
+            warm = Runner(args, client)
+            await asyncio.gather(*(warm.one(i) for i in range(min(args.unique, args.requests))))
+        await fake.post("/__reset")
+
+        counter = iter(range(args.requests))
+        deadline = time.perf_counter() + args.duration if args.duration else None
+
+        async def worker() -> None:
+            for i in counter:
+                if deadline is not None and time.perf_counter() > deadline:
+                    return
+                await runner.one(i)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - t0
+        upstream = (await fake.get("/__stats")).json()
+
+    done = len(runner.latencies)
+    per_item = max(1, runner.items)
+    return {
+        "scenario": args.scenario,
+        "requests": done,
+        "items": runner.items,
+        "concurrency": args.concurrency,
+        "elapsed_s": elapsed,
+        "rps": done / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            q: percentile(runner.latencies, p) * 1000 for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+        },
+        "ttfb_ms": {q: percentile(runner.ttfb, p) * 1000 for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "errors": runner.errors,
+        "upstream_per_item": {k: v / per_item for k, v in sorted(upstream.items())},
+    }
+
+
+def report(res: Dict[str, Any], base: Optional[Dict[str, Any]] = None) -> None:
+    def delta(new: float, old: Optional[float], lower_is_better: bool = True) -> str:
+        if old is None or not old or math.isnan(old):
+            return ""
+        pct = (new - old) / old * 100
+        better = pct < 0 if lower_is_better else pct > 0
+        return f"  ({pct:+.1f}% {'better' if better else 'worse'})"
+
+    b = base or {}
+    if base and base.get("scenario") != res["scenario"]:
+        print(f"  note: baseline scenario is {base.get('scenario')!r}, comparison is not like-for-like")
+    print(
+        f"scenario={res['scenario']} requests={res['requests']} items={res['items']} "
+        f"concurrency={res['concurrency']} elapsed={res['elapsed_s']:.2f}s"
+    )
+    print(f"  throughput : {res['rps']:.1f} req/s{delta(res['rps'], b.get('rps'), lower_is_better=False)}")
+    for key, label in (("latency_ms", "latency"), ("ttfb_ms", "first byte")):
+        for q, v in res[key].items():
+            print(f"  {label:<10} {q}: {v:9.1f} ms{delta(v, b.get(key, {}).get(q))}")
+    if res["errors"]:
+        print(f"  errors     : {res['errors']}")
+    for k, v in res["upstream_per_item"].items():
+        print(f"  upstream {k:<20}: {v:8.2f} / item{delta(v, b.get('upstream_per_item', {}).get(k))}")
+
+
+def _wait_healthy(url: str, proc: subprocess.Popen, timeout_s: float = 30.0) -> None:
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url}: process exited with code {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url}: not ready after {timeout_s}s")
+
+
+def spawn(args: argparse.Namespace, workdir: Path) -> List[subprocess.Popen]:
+    """Заглушки и сервис в дочерних процессах; сервис направлен на заглушки, кеши — во временном каталоге."""
+    fake_port, app_port = args.fake_port, args.app_port
+    args.fake_url = f"http://127.0.0.1:{fake_port}"
+    args.url = f"http://127.0.0.1:{app_port}"
+    fake_cmd = [sys.executable, "-m", "benchmarks.fake_upstreams", "--port", str(fake_port), *args.fake_args]
+    env = {
+        **os.environ,
+        "YANDEX_GEOCODER_URL": f"{args.fake_url}/yandex/v1",
+        "ORS_DIRECTIONS_URL": f"{args.fake_url}/ors/v2/directions/driving-car/geojson",
+        "OPENAI_BASE_URL": f"{args.fake_url}/openai/v1",
+        "OPENAI_API_KEY": "bench",
+        "YANDEX_GEOCODER_API_KEY": "bench",
+        "ORS_API_KEY": "bench",
+        "GEOCODE_CACHE_PATH": str(workdir / "geocode.sqlite3"),
+        "CONVERSATIONS_DIR": str(workdir / "conversations"),
+        "CONVERSATIONS_DB_PATH": str(workdir / "conversations.sqlite3"),
+        "LOG_PATH": str(workdir / "app.log"),
+        "LOG_LVL": "WARNING",
+    }
+    for kv in args.env:
+        k, _, v = kv.partition("=")
+        env[k] = v
+    app_cmd = [sys.executable, "-m", "uvicorn", "app.api:app", "--port", str(app_port), "--log-level", "warning"]
+    procs = [subprocess.Popen(fake_cmd), subprocess.Popen(app_cmd, env=env)]
+    _wait_healthy(f"{args.fake_url}/__stats", procs[0])
+    _wait_healthy(f"{args.url}/api/health", procs[1])
+    return procs
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument(
+        "--scenario", default="route", choices=["route", "route_stream", "route_batch", "chat", "chat_stream"]
+    )
+    ap.add_argument("--url", default="http://127.0.0.1:8000", help="адрес сервиса")
+    ap.add_argument("--fake-url", default="http://127.0.0.1:9100", help="адрес заглушек (для счётчиков)")
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--duration", type=float, default=None, help="ограничить прогон по времени, с")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--unique", type=int, default=50, help="разных маршрутов в пуле")
+    ap.add_argument("--route-km", type=float, default=300.0)
+    ap.add_argument("--waypoints", type=int, default=0)
+    ap.add_argument("--batch-size", type=int, default=10)
+    ap.add_argument("--turns", type=int, default=5, help="реплик на диалог (chat)")
+    ap.add_argument("--warmup", action="store_true", help="прогреть кеши перед замером")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--save", type=Path, default=None, help="сохранить результат в JSON")
+    ap.add_argument("--compare", type=Path, default=None, help="сравнить с сохранённым результатом")
+    ap.add_argument("--spawn", action="store_true", help="запустить заглушки и сервис самому")
+    ap.add_argument("--fake-port", type=int, default=9100)
+    ap.add_argument("--app-port", type=int, default=8765)
+    ap.add_argument("--fake-arg", dest="fake_args", action="append", default=[], help="аргумент для fake_upstreams")
+    ap.add_argument("--env", action="append", default=[], help="KEY=VALUE для процесса сервиса (с --spawn)")
+    args = ap.parse_args()
+
+    procs: List[subprocess.Popen] = []
+    with tempfile.TemporaryDirectory(prefix="load-") as tmp:
+        try:
+            if args.spawn:
+                procs = spawn(args, Path(tmp))
+            res = asyncio.run(run(args))
+        finally:
+            for p in procs:
+                p.terminate()
+            for p in procs:
+                p.wait(timeout=10)
+
+    base = loads(args.compare.read_bytes()) if args.compare else None
+    report(res, base)
+    if args.save:
+        args.save.write_bytes(dumps(res))
+
+
+if __name__ == "__main__":
+    main()